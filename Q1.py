@@ -1,7 +1,7 @@
 import math
 import itertools
 import poker as pkr
-from tools import Clock
+from tools import Clock, MemoryMonitor
 
 deck = pkr.Deck.standard_32_card_deck()
 # deck = pkr.Deck.standard_52_card_deck()
@@ -14,29 +14,46 @@ print("The deck has {} cards.".format(n_cards))
 n_combi = int(math.factorial(n_cards) / (math.factorial(n_drawn_cards) * math.factorial(n_cards - n_drawn_cards)))
 print("{} combinations of {} cards among {} cards.".format(n_combi, n_drawn_cards, n_cards))
 
+# memory instrumentation (opt-in): eg. MemoryMonitor(budget=2 * 1024 ** 3, trace=True) reports the memory of each phase
+# and switches to counting the hand names on the fly if the list of the best hands gets close to the budget.
+memory = MemoryMonitor(budget=None, trace=False)
+
 # generating combinations
 Clock.elapsed()  # prints the elapsed time as a reference
-best_hands = []
+best_hands = []  # None once the hand names are counted on the fly
+combination_count = {}
 # exhaustive search
-for i, cards in enumerate(itertools.combinations(deck, n_drawn_cards)):  # iterates through all the combinations
-    best_hand = pkr.Hand.best_from_cards(cards)
-    best_hands.append(best_hand)
-    if i % (n_combi//100) == 0:
-        print("simulation progress: {:.1%}".format(i / n_combi))
-print("{} combinations evaluated".format(len(best_hands)))
+with memory.phase("evaluate", n_samples=n_combi):
+    for i, cards in enumerate(itertools.combinations(deck, n_drawn_cards)):  # iterates through all the combinations
+        best_hand = pkr.Hand.best_from_cards(cards)
+        if best_hands is None:
+            combination_count[best_hand.name] = combination_count.get(best_hand.name, 0) + 1
+        else:
+            best_hands.append(best_hand)
+        if i % (n_combi//100) == 0:
+            print("simulation progress: {:.1%}".format(i / n_combi))
+            if best_hands is not None and memory.over_budget():
+                print("Close to the memory budget: switching to streaming aggregation.")
+                for hand in best_hands:
+                    combination_count[hand.name] = combination_count.get(hand.name, 0) + 1
+                best_hands = None
+            memory.check()
+print("{} combinations evaluated".format(n_combi))
 Clock.elapsed()  # prints the elapsed time since the last call to Clock.elapsed()
 
 # counting the results
-combination_count = {}
-for hand in best_hands:
-    name = hand.name
-    combination_count[name] = combination_count.get(name, 0) + 1
+with memory.phase("aggregate", n_samples=n_combi):
+    for hand in best_hands or ():
+        name = hand.name
+        combination_count[name] = combination_count.get(name, 0) + 1
 
 # counting percentages
-n_total = len(best_hands)
+n_total = sum(combination_count.values())
 combination_ratios = {name: v/n_total for name, v in combination_count.items()}
 sum_ratios = sum(v for v in combination_ratios.values())
 assert abs(1 - sum_ratios) < 1e-6  # checking that the sum of probabilities is close to 1.
 
 print(combination_count)
 print(combination_ratios)
+if memory.budget is not None or memory.trace:
+    print(memory.report())
@@ -19,8 +19,8 @@ for c1 in cards_to_test[:13]:
         earnings = []
         for i in range(n_stories):
             game.reset(shuffle_deck=True)
-            game.deal_card_to_player(player_1, str(c1))
-            game.deal_card_to_player(player_1, str(c2))
+            game.deal_card_to_player(player_1, c1)
+            game.deal_card_to_player(player_1, c2)
 
             for player in game.players[1:]:
                 game.deal_card_to_player(player)
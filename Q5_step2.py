@@ -35,8 +35,8 @@ for c1, c2 in hands_to_test:
     earnings = []
     for i in range(n_stories):
         game.reset(True)
-        game.deal_card_to_player(player_1, str(c1))
-        game.deal_card_to_player(player_1, str(c2))
+        game.deal_card_to_player(player_1, c1)
+        game.deal_card_to_player(player_1, c2)
 
         for player in game.players[1:]:
             game.deal_card_to_player(player)
@@ -0,0 +1,304 @@
+"""Command line entry point running the experiments of the Q*.py and QCM_*.py scripts with the simulation engine.
+
+Subcommands:
+- categories: frequencies of the hand names among random draws of 5 or 7 cards (Q1.py, Q2.py).
+- coverage: coverage of the confidence ranges of the frequencies over many trials (Q2.py).
+- equity: win/lose/tie probabilities of a hero against known and random hands (Q4.py, QCM_Q1.py).
+- ranking: average earnings of hand classes at a table of n players (Q5_step1.py, Q5_step2.py, QCM_Q2_*.py).
+Example usage :
+python cli.py categories --deck 32 --cards 5 --exhaustive
+python cli.py categories --deck 52 --cards 7 --importance --stories 200000 --workers 4
+python cli.py coverage --deck 32 --cards 5 --stories 40000 --trials 10000 --workers 4
+python cli.py equity --hands 9s8s --players 2 --stories 100000 --workers 4 --seed 1
+python cli.py equity --hands AsKs 9d9c --players 3 --target-ci 0.002 --output json
+python cli.py ranking --players 8 --stories 1600 --workers 8 --output csv > Q5_step1.csv
+python cli.py ranking --hands AA KK AKs AKo --players 8 --target-ci 0.01
+python cli.py ranking --hands AA AKs --players 8 --strategy control_variate --matchups matchups.bin
+"""
+import sys
+import csv
+import json
+import math
+import argparse
+
+import variance
+import matchups
+import simulation
+import importance
+import coverage_experiment
+from store import ResultStore
+from tools import RunningSeries, Clock
+
+
+def _series_row(series):
+    low, high = series.confidence_range
+    return {"mean": series.mean, "std": series.standard_deviation, "ci_low": low, "ci_high": high, "n": series.n}
+
+
+def _half_width(series):
+    low, high = series.confidence_range
+    return (high - low) / 2
+
+
+def _rounds(args, precision_reached):
+    """
+    Yields the indexes of the rounds of simulation to run. Without --target-ci there is a single round of
+    --stories deals. Otherwise rounds of --stories deals are run until precision_reached() returns True or until
+    --max-stories deals have been simulated.
+    """
+    round_index = 0
+    while True:
+        yield round_index
+        round_index += 1
+        if args.target_ci is None or precision_reached() or round_index * args.stories >= args.max_stories:
+            return
+
+
+def run_categories(args, engine):
+    deck_ids = simulation.deck_card_ids(args.deck)
+    if args.exhaustive:
+        counts = simulation.count_categories(deck_ids, args.cards)
+    elif args.importance:
+        return _run_categories_with_importance(args, engine, deck_ids)
+    else:
+        counts = {}
+        n_total = 0
+
+        def precision_reached():
+            return all(1.96 * math.sqrt(c / n_total * (1 - c / n_total) / n_total) <= args.target_ci
+                       for c in counts.values())
+
+        for round_index in _rounds(args, precision_reached):
+            units = [(deck_ids, args.cards, n, args.seed, ("categories", round_index, i))
+                     for i, n in enumerate(simulation.split_stories(args.stories, args.unit_size))]
+            for unit_counts in engine.map(simulation.categories_unit, units):
+                for name, count in unit_counts.items():
+                    counts[name] = counts.get(name, 0) + count
+            n_total += args.stories
+    n_total = sum(counts.values())
+    return [{"name": name, "count": count, "ratio": count / n_total}
+            for name, count in sorted(counts.items(), key=lambda x: x[1], reverse=True)]
+
+
+def _run_categories_with_importance(args, engine, deck_ids):
+    """Frequencies of the hand names estimated by importance sampling, with confidence ranges (see importance.py)."""
+    results = {name: RunningSeries() for name in importance.HAND_NAMES}
+
+    def precision_reached():
+        return all(_half_width(series) <= args.target_ci for series in results.values())
+
+    for round_index in _rounds(args, precision_reached):
+        round_results = importance.estimate_categories(deck_ids, args.cards, args.stories, engine=engine,
+                                                       seed=args.seed, unit_size=args.unit_size, key=(round_index,))
+        for name, series in round_results.items():
+            results[name].merge(series)
+    rows = [dict(name=name, **_series_row(series)) for name, series in results.items() if series.mean > 0]
+    rows.sort(key=lambda row: row["mean"], reverse=True)
+    return rows
+
+
+def run_coverage(args, engine):
+    return coverage_experiment.run_coverage(simulation.deck_card_ids(args.deck), args.cards, args.stories, args.trials,
+                                            args.half_width, engine=engine, seed=args.seed,
+                                            unit_size=max(1, args.unit_size // args.stories))
+
+
+def run_equity(args, engine):
+    known_hands = [simulation.card_ids_from_string(hand) for hand in args.hands]
+    results = {"Win": RunningSeries(), "Lose": RunningSeries(), "Tie": RunningSeries()}
+
+    def precision_reached():
+        return max(_half_width(series) for series in results.values()) <= args.target_ci
+
+    for round_index in _rounds(args, precision_reached):
+        units = [(known_hands, args.players, n, args.seed, ("equity", round_index, i))
+                 for i, n in enumerate(simulation.split_stories(args.stories, args.unit_size))]
+        for states in engine.map(simulation.outcomes_unit, units):
+            for name, state in states.items():
+                results[name].merge(RunningSeries.from_state(state))
+    return [dict(outcome=name, **_series_row(series)) for name, series in results.items()]
+
+
+def run_ranking(args, engine):
+    hand_classes = args.hands or simulation.all_hand_classes()
+    if args.store is not None:
+        return _run_ranking_with_store(args, engine, hand_classes)
+    if args.strategy != "plain":
+        return _run_ranking_with_strategy(args, engine, hand_classes)
+    results = {hand_class: RunningSeries() for hand_class in hand_classes}
+
+    def precision_reached():
+        return all(_half_width(series) <= args.target_ci for series in results.values())
+
+    for round_index in _rounds(args, precision_reached):
+        unfinished = [hand_class for hand_class, series in results.items()
+                      if not series.n or args.target_ci is None or _half_width(series) > args.target_ci]
+        units = [(simulation.hand_class_cards(hand_class), args.players, n, args.seed, (hand_class, round_index, i))
+                 for hand_class in unfinished
+                 for i, n in enumerate(simulation.split_stories(args.stories, args.unit_size))]
+        for unit, state in zip(units, engine.map(simulation.earnings_unit, units)):
+            results[unit[4][0]].merge(RunningSeries.from_state(state))
+    rows = [dict(hand=hand_class, **_series_row(series)) for hand_class, series in results.items()]
+    rows.sort(key=lambda row: row["mean"], reverse=True)
+    return rows
+
+
+def _run_ranking_with_store(args, engine, hand_classes):
+    """Ranking where every hand class is topped up to --stories deals in the persistent result store. With
+    --target-ci, the hand classes whose confidence range is still too wide get --stories more deals at each round."""
+    results = {}
+
+    def precision_reached():
+        return all(_half_width(series) <= args.target_ci for series in results.values())
+
+    with ResultStore(args.store) as result_store:
+        for round_index in _rounds(args, precision_reached):
+            for hand_class in hand_classes:
+                series = results.get(hand_class)
+                if series is not None and (args.target_ci is None or _half_width(series) <= args.target_ci):
+                    continue
+                n_stories = args.stories if series is None else series.n + args.stories
+                results[hand_class] = result_store.estimate(simulation.hand_class_cards(hand_class), args.players,
+                                                            n_stories, engine=engine, seed=args.seed)
+    rows = [dict(hand=hand_class, **_series_row(series)) for hand_class, series in results.items()]
+    rows.sort(key=lambda row: row["mean"], reverse=True)
+    return rows
+
+
+def _run_ranking_with_strategy(args, engine, hand_classes):
+    """Ranking where the earnings of every hand class are estimated with a variance reduction strategy (see
+    variance.py). The rows also give the variance reduction factor of the strategy."""
+    states = {hand_class: [] for hand_class in hand_classes}
+    estimates = {}
+    matrix = matchups.MatchupMatrix.load(args.matchups) if args.strategy == "control_variate" else None
+
+    def half_width(estimate):
+        low, high = estimate.confidence_range
+        return (high - low) / 2
+
+    def precision_reached():
+        return all(half_width(estimate) <= args.target_ci for estimate in estimates.values())
+
+    for round_index in _rounds(args, precision_reached):
+        unfinished = [hand_class for hand_class in hand_classes if hand_class not in estimates or
+                      args.target_ci is None or half_width(estimates[hand_class]) > args.target_ci]
+        units = [(args.strategy, simulation.hand_class_cards(hand_class), args.players, n, args.seed,
+                  (args.strategy, hand_class, round_index, i), args.stratify_by)
+                 for hand_class in unfinished
+                 for i, n in enumerate(simulation.split_stories(args.stories, args.unit_size))]
+        for unit, state in zip(units, engine.map(variance.variance_unit, units)):
+            states[unit[5][1]].append(state)
+        for hand_class in unfinished:
+            reference_equity = matrix.equity_against_random(hand_class) if matrix is not None else None
+            reference_variance = matrix.equity_against_random_variance(hand_class) if matrix is not None else 0.
+            estimates[hand_class] = variance.combine(args.strategy, states[hand_class],
+                                                     simulation.hand_class_cards(hand_class), reference_equity,
+                                                     args.stratify_by, reference_variance)
+    rows = []
+    for hand_class, estimate in estimates.items():
+        low, high = estimate.confidence_range
+        rows.append({"hand": hand_class, "mean": estimate.mean, "std": estimate.standard_error * math.sqrt(estimate.n),
+                     "ci_low": low, "ci_high": high, "n": estimate.n,
+                     "variance_reduction_factor": estimate.variance_reduction_factor})
+    rows.sort(key=lambda row: row["mean"], reverse=True)
+    return rows
+
+
+def write_rows(rows, output_format, file=sys.stdout):
+    """
+    Writes the rows of results in the requested format.
+    :param rows: list of dictionaries with the same keys.
+    :param output_format: string. "text", "json" or "csv".
+    :param file: file object.
+    :return: None.
+    """
+    if output_format == "json":
+        json.dump(rows, file, indent=2)
+        file.write("\n")
+    elif output_format == "csv":
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()) if rows else [])
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            print(tuple(row.values()), file=file)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Texas Hold'em Monte-Carlo simulations.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--stories", type=int, default=100000,
+                        help="number of deals (per hand class for ranking, per round with --target-ci)")
+    common.add_argument("--target-ci", type=float, default=None,
+                        help="simulate rounds of --stories deals until the half width of every 95%% confidence "
+                             "range is below this value")
+    common.add_argument("--max-stories", type=int, default=10 ** 8,
+                        help="maximal number of deals with --target-ci")
+    common.add_argument("--workers", type=int, default=1, help="number of workers")
+    common.add_argument("--backend", choices=simulation.BACKENDS, default="process",
+                        help="execution backend (threads only run in parallel on free-threaded Python)")
+    common.add_argument("--seed", default=None,
+                        help="seed of the random generators. Seeded results do not depend on --workers")
+    common.add_argument("--unit-size", type=int, default=simulation.UNIT_SIZE, help="number of deals per work unit")
+    common.add_argument("--output", choices=["text", "json", "csv"], default="text", help="output format")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    categories = subparsers.add_parser("categories", parents=[common], help="frequencies of the hand names (Q1, Q2)")
+    categories.add_argument("--deck", type=int, choices=[32, 52], default=32, help="number of cards of the deck")
+    categories.add_argument("--cards", type=int, choices=range(1, 8), default=5, help="number of cards drawn")
+    categories.add_argument("--exhaustive", action="store_true", help="enumerates every combination of cards")
+    categories.add_argument("--importance", action="store_true",
+                            help="importance sampling: oversamples the rare hands, with a confidence range per name")
+    categories.set_defaults(function=run_categories)
+
+    coverage = subparsers.add_parser("coverage", parents=[common],
+                                     help="coverage of the confidence ranges of the frequencies (Q2)")
+    coverage.add_argument("--deck", type=int, choices=[32, 52], default=32, help="number of cards of the deck")
+    coverage.add_argument("--cards", type=int, choices=range(1, 8), default=5, help="number of cards drawn")
+    coverage.add_argument("--trials", type=int, default=100, help="number of trials of --stories draws")
+    coverage.add_argument("--half-width", type=float, default=0.005,
+                          help="half width of the fixed interval around the exact probability")
+    coverage.set_defaults(function=run_coverage)
+
+    equity = subparsers.add_parser("equity", parents=[common], help="win/lose/tie of known hands (Q4, QCM_Q1)")
+    equity.add_argument("--hands", nargs="+", required=True,
+                        help="private cards of the hero then of the opponents with known cards (eg. AsKs 9d9c)")
+    equity.add_argument("--players", type=int, default=2, help="number of players")
+    equity.set_defaults(function=run_equity)
+
+    ranking = subparsers.add_parser("ranking", parents=[common], help="earnings of hand classes (Q5, QCM_Q2)")
+    ranking.add_argument("--hands", nargs="+", default=None,
+                         help="hand classes to rank (eg. AA AKs AKo). Default: the 169 hand classes")
+    ranking.add_argument("--players", type=int, default=8, help="number of players")
+    ranking.add_argument("--store", default=None,
+                         help="path of a persistent result store (SQLite). The hand classes are only simulated for "
+                              "the deals missing in the store, up to --stories deals (or until --target-ci is reached)")
+    ranking.add_argument("--strategy", choices=variance.STRATEGIES, default="plain",
+                         help="sampling strategy reducing the variance of the earnings (see variance.py)")
+    ranking.add_argument("--stratify-by", choices=["flop_category", "suit_pattern"], default="flop_category",
+                         help="strata of the flops of the stratified strategy")
+    ranking.add_argument("--matchups", default=None,
+                         help="path of the matchup matrix (see matchups.py) giving the reference equity of the "
+                              "control_variate strategy and the variance of its Monte Carlo error")
+    ranking.set_defaults(function=run_ranking)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "strategy", "plain") != "plain" and args.store is not None:
+        parser.error("--store only stores the results of the plain strategy")
+    if getattr(args, "strategy", None) == "control_variate" and args.matchups is None:
+        parser.error("the control_variate strategy needs --matchups")
+    Clock.elapsed(print_time=False)
+    with simulation.Engine(args.workers, args.backend) as engine:
+        rows = args.function(args, engine)
+    time_since_start, elapsed = Clock.elapsed(print_time=False)
+    write_rows(rows, args.output)
+    if args.output == "text":
+        print("Elapsed: {:.3f}s".format(elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Coverage experiments of the confidence ranges of the hand name frequencies (the experiment of Q2.py).
+
+Q2.py runs 100 trials of 40,000 draws of 5 cards and counts how often the estimated probability of a pair falls in a
+fixed interval around the exact probability. Here all the trials are run as one batched workload: the names of the best
+hands of every combination of cards of the deck are computed once with the table evaluator and stored as one byte per
+combination. A draw of n_cards cards is then a uniform draw of a combination index (random.choices on the bytes), and
+the counts of a trial are byte counts of its draws, so the evaluation and the counting run at the speed of C loops.
+The reference of the experiment is the exact probability of every hand name (see simulation.count_categories()). For the
+decks with too many combinations for a table (eg. 7 cards of 52), the draws are evaluated one by one.
+
+For every hand name, the report gives the exact probability, the mean and the standard deviation of the estimates over
+the trials, the coverage of the 95% confidence range of the trials (ratio of the trials whose range contains the exact
+probability, expected to be close to 0.95) and, as in Q2.py, the ratio of the trials whose estimate is within a fixed
+half width of the exact probability.
+Example usage :
+rows = run_coverage(simulation.deck_card_ids(32), n_cards=5, n_stories=40000, n_trials=10000, seed=0)
+print([row for row in rows if row["name"] == "Pair"])
+"""
+import math
+import random
+import itertools
+
+import evaluator
+import simulation
+
+MAX_TABLE_SIZE = 3 * 10 ** 6  # maximal number of combinations of a table of hand names (one byte each)
+HAND_CODES = {name: code for code, name in enumerate(evaluator.HAND_NAMES)}
+
+_tables = {}  # (deck ids, n_cards) -> bytes. The tables built in this process.
+
+
+def combination_names(deck_ids, n_cards):
+    """
+    Returns the codes (indexes in evaluator.HAND_NAMES) of the names of the best hands of every combination of n_cards
+    cards of the deck, one byte per combination. The table is built on first use and kept in memory.
+    :param deck_ids: sequence of card ids.
+    :param n_cards: integer.
+    :return: bytes.
+    """
+    key = (tuple(deck_ids), n_cards)
+    if key not in _tables:
+        evaluate = evaluator.get_tables(evaluator.deck_values(key[0])).evaluate
+        codes = {}  # strength -> code
+        table = bytearray(math.comb(len(key[0]), n_cards))
+        for i, cards in enumerate(itertools.combinations(key[0], n_cards)):
+            strength = evaluate(cards)
+            code = codes.get(strength)
+            if code is None:
+                code = codes[strength] = HAND_CODES[evaluator.hand_name(strength)]
+            table[i] = code
+        _tables[key] = bytes(table)
+    return _tables[key]
+
+
+def exact_probabilities(deck_ids, n_cards):
+    """Returns the exact probability of every hand name (dictionary name -> float)."""
+    counts = simulation.count_categories(deck_ids, n_cards)
+    n_combinations = math.comb(len(deck_ids), n_cards)
+    return {name: counts.get(name, 0) / n_combinations for name in evaluator.HAND_NAMES}
+
+
+def trial_counts(deck_ids, n_cards, n_stories, n_trials, rng=random):
+    """
+    Runs n_trials trials of n_stories draws of n_cards cards and counts the hand names of every trial.
+    :param deck_ids: sequence of card ids.
+    :param n_cards: integer.
+    :param n_stories: integer. Number of draws per trial.
+    :param n_trials: integer.
+    :param rng: random.Random or the random module.
+    :return: list of n_trials lists of counts, indexed like evaluator.HAND_NAMES.
+    """
+    codes = range(len(evaluator.HAND_NAMES))
+    if math.comb(len(deck_ids), n_cards) <= MAX_TABLE_SIZE:
+        table = combination_names(deck_ids, n_cards)
+        counts = []
+        for i in range(n_trials):
+            draws = bytes(rng.choices(table, k=n_stories))
+            counts.append([draws.count(code) for code in codes])
+        return counts
+    counts = []
+    for i in range(n_trials):
+        names = simulation.sample_categories(deck_ids, n_cards, n_stories, rng)
+        counts.append([names.get(name, 0) for name in evaluator.HAND_NAMES])
+    return counts
+
+
+def coverage_unit(deck_ids, n_cards, n_stories, n_trials, seed, key):
+    """Work unit of run_coverage(). Returns the counts of n_trials trials."""
+    return trial_counts(deck_ids, n_cards, n_stories, n_trials, simulation.unit_rng(seed, *key))
+
+
+def run_coverage(deck_ids, n_cards=5, n_stories=40000, n_trials=100, half_width=0.005, exact=None, engine=None,
+                 seed=None, unit_size=100):
+    """
+    Runs the coverage experiment of Q2.py.
+    :param deck_ids: sequence of card ids.
+    :param n_cards: integer.
+    :param n_stories: integer. Number of draws per trial.
+    :param n_trials: integer.
+    :param half_width: float. Half width of the fixed interval around the exact probability (0.005 in Q2.py).
+    :param exact: dictionary name -> exact probability, or None to compute it with exact_probabilities().
+    :param engine: simulation.Engine or None. If provided, the trials are run by the engine.
+    :param seed: integer or None.
+    :param unit_size: integer. Number of trials per work unit.
+    :return: list of dictionaries with the keys "name", "exact", "mean", "std", "ci_coverage" and "interval_ratio".
+    """
+    deck_ids = list(deck_ids)
+    if exact is None:
+        exact = exact_probabilities(deck_ids, n_cards)
+    units = [(deck_ids, n_cards, n_stories, n, seed, ("coverage", i))
+             for i, n in enumerate(simulation.split_stories(n_trials, unit_size))]
+    counts = []
+    for unit_counts in engine.map(coverage_unit, units) if engine is not None else [coverage_unit(*u) for u in units]:
+        counts.extend(unit_counts)
+
+    rows = []
+    for code, name in enumerate(evaluator.HAND_NAMES):
+        p = exact.get(name, 0.)
+        estimates = [trial[code] / n_stories for trial in counts]
+        mean = sum(estimates) / n_trials
+        std = math.sqrt(sum((e - mean) ** 2 for e in estimates) / (n_trials - 1)) if n_trials > 1 else 0.
+        n_covered = sum(1 for e in estimates if abs(e - p) <= 1.96 * math.sqrt(e * (1 - e) / n_stories))
+        n_in_interval = sum(1 for e in estimates if abs(e - p) <= half_width)
+        rows.append({"name": name, "exact": p, "mean": mean, "std": std, "ci_coverage": n_covered / n_trials,
+                     "interval_ratio": n_in_interval / n_trials})
+    return rows
@@ -0,0 +1,442 @@
+"""A lookup-table hand evaluator working on integer card ids.
+
+A card id is an integer in [0, 52) equal to suit_index * 13 + (value - 2), which is the order of the cards in
+Deck.standard_52_card_deck(). The strength returned by the evaluator is exactly the strength computed by
+poker.Hand.best_from_cards() for the same cards, so both can be mixed freely.
+
+The tables can be published once in shared memory so that the workers of a process pool attach to them without
+copying them. Example usage :
+with SharedTables() as shared:
+    with multiprocessing.Pool(4, initializer=attach_shared_tables, initargs=(shared.handle,)) as pool:
+        strengths = pool.map(evaluate, list_of_card_id_lists)
+"""
+import os
+import mmap
+import math
+import array
+import struct
+import itertools
+import collections
+
+N_SUITS = 4
+N_RANKS = 13
+N_CARDS = N_SUITS * N_RANKS
+MAX_CARDS = 7  # the evaluator handles any number of cards from 0 to MAX_CARDS
+STANDARD_VALUES = tuple(range(2, 15))  # values of the ranks of the 52 card deck
+SHORT_DECK_VALUES = tuple(range(7, 15))  # values of the ranks of the 32 card deck
+
+# The built tables are cached on disk in this directory. The cache file name contains a hash of this source file so
+# that a change of the evaluator code never loads stale tables.
+CACHE_DIR = os.environ.get("POKER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "poker_monte_carlo"))
+_CACHE_MAGIC = b"PKREVAL1"
+_CACHE_HEADER = struct.Struct("<8sqq")  # magic, length of the flush table, length of the multiset table
+
+CATEGORY_NAMES = ["High card", "Pair", "Two pairs", "Three of a kind", "Straight", "Flush", "Full house",
+                  "Four of a kind", "Straight flush"]
+CATEGORY_UNIT = 100 ** 5  # strength // CATEGORY_UNIT is the category of the hand (index in CATEGORY_NAMES)
+ROYAL_STRAIGHT_FLUSH_STRENGTH = 8 * CATEGORY_UNIT + 14 * 100 ** 4
+HAND_NAMES = CATEGORY_NAMES + ["Royal straight flush"]  # names returned by hand_name(), except "Nothing"
+
+
+def remaining_card_ids(*excluded_cards):
+    """
+    Returns the ids of the cards of the 52 card deck which are not excluded. The excluded cards are gathered in a bit
+    mask (as in poker.CardSet), so checking a card costs a single AND.
+    :param excluded_cards: sequences of card ids.
+    :return: list of integers.
+    """
+    excluded_mask = 0
+    for card_ids in excluded_cards:
+        for c in card_ids:
+            excluded_mask |= 1 << c
+    return [c for c in range(N_CARDS) if not excluded_mask >> c & 1]
+
+
+def category(strength):
+    """Returns the category of a hand strength: 0 for "High card" up to 8 for "Straight flush"."""
+    return strength // CATEGORY_UNIT
+
+
+def hand_name(strength):
+    """Returns the name of a hand from its strength, with the same names as poker.Hand."""
+    if strength == 0:
+        return "Nothing"
+    if strength == ROYAL_STRAIGHT_FLUSH_STRENGTH:
+        return "Royal straight flush"
+    return CATEGORY_NAMES[strength // CATEGORY_UNIT]
+
+
+def _encode(strength_indicators):
+    """Turns a list of strength indicators (category first, then the values) into a strength."""
+    return sum(s * 100 ** (5 - i) for i, s in enumerate(strength_indicators))
+
+
+def _straight_high(values_set):
+    """Returns the highest card value of the best straight contained in values_set, or 0 if there is none."""
+    for high in sorted(values_set, reverse=True):
+        if all(high - i in values_set for i in range(1, 5)):
+            return high
+    if {14, 2, 3, 4, 5} <= values_set:  # case where the Ace counts as a 1: "A 2 3 4 5"
+        return 5
+    return 0
+
+
+def _multiset_strength(values):
+    """Returns the strength of the best hand made of cards with these values, ignoring flushes."""
+    n_cards = len(values)
+    counts = {}
+    for v in values:
+        counts[v] = counts.get(v, 0) + 1
+    by_count = {c: sorted((v for v, n in counts.items() if n >= c), reverse=True) for c in (2, 3, 4)}
+
+    def kickers(excluded, n):
+        return sorted((v for v in values if v not in excluded), reverse=True)[:n]
+
+    if n_cards >= 4 and by_count[4]:
+        quads = by_count[4][0]
+        return _encode([7, quads] + kickers({quads}, min(1, n_cards - 4))[:1])
+    if n_cards >= 5 and by_count[3] and len(by_count[2]) >= 2:
+        trips = by_count[3][0]
+        pair = [v for v in by_count[2] if v != trips][0]
+        return _encode([6, trips, pair])
+    straight_high = _straight_high(set(values)) if n_cards >= 5 else 0
+    if straight_high:
+        return _encode([4, straight_high])
+    if n_cards >= 3 and by_count[3]:
+        trips = by_count[3][0]
+        return _encode([3, trips] + kickers({trips}, min(2, n_cards - 3)))
+    if n_cards >= 4 and len(by_count[2]) >= 2:
+        pairs = by_count[2][:2]
+        return _encode([2] + pairs + kickers(set(pairs), min(1, n_cards - 4)))
+    if by_count[2]:
+        pair = by_count[2][0]
+        return _encode([1, pair] + kickers({pair}, min(3, n_cards - 2)))
+    if n_cards >= 1:
+        return _encode([0] + sorted(values, reverse=True)[:5])
+    return 0
+
+
+def _flush_strength(values_set):
+    """Returns the strength of the best flush (or straight flush) made of suited cards with these values."""
+    straight_high = _straight_high(values_set)
+    if straight_high:
+        return _encode([8, straight_high])
+    return _encode([5] + sorted(values_set, reverse=True)[:5])
+
+
+def _multiset_keys(n_ranks):
+    """
+    Returns (bases, keys) used to index the multisets of ranks. The multisets of k ranks among n_ranks are numbered
+    with the combinatorial number system: the ascending ranks r_1 <= ... <= r_k are mapped to the combination
+    r_i + i - 1 whose colexicographic index is the sum of the binomial coefficients C(r_i + i - 1, i).
+    :return: (list of integers, list of lists of integers).
+    bases[k] is the offset of the multisets of size k in the table and keys[i][r] = C(r + i - 1, i).
+    """
+    bases = []
+    offset = 0
+    for k in range(MAX_CARDS + 1):
+        bases.append(offset)
+        offset += math.comb(n_ranks - 1 + k, k)
+    bases.append(offset)  # total size of the table
+    keys = [[0] * n_ranks] + [[math.comb(r + i - 1, i) for r in range(n_ranks)] for i in range(1, MAX_CARDS + 1)]
+    return bases, keys
+
+
+def build_arrays(values=STANDARD_VALUES):
+    """
+    Builds the lookup tables of the evaluator for a deck whose ranks have the given values.
+    :param values: tuple of integers.
+    The values of the ranks of the deck, in ascending order.
+    :return: (array, array).
+    The flush table indexed by a bit mask of suited ranks and the table indexed by the multiset of the ranks.
+    """
+    n_ranks = len(values)
+    flush = array.array("q", bytes(8 * 2 ** n_ranks))
+    for mask in range(2 ** n_ranks):
+        suited_values = {values[r] for r in range(n_ranks) if mask >> r & 1}
+        if len(suited_values) >= 5:
+            flush[mask] = _flush_strength(suited_values)
+
+    bases, keys = _multiset_keys(n_ranks)
+    multiset = array.array("q", bytes(8 * bases[-1]))
+    for k in range(MAX_CARDS + 1):
+        for ranks in _sorted_multisets(n_ranks, k):
+            index = bases[k] + sum(keys[i][r] for i, r in enumerate(ranks, 1))
+            multiset[index] = _multiset_strength([values[r] for r in ranks])
+    return flush, multiset
+
+
+def _sorted_multisets(n_ranks, k):
+    """Yields every ascending tuple of k ranks among n_ranks where no rank appears more than N_SUITS times."""
+    def rec(start, remaining, prefix):
+        if remaining == 0:
+            yield tuple(prefix)
+            return
+        for r in range(start, n_ranks):
+            if prefix[-N_SUITS:] == [r] * N_SUITS:
+                continue
+            prefix.append(r)
+            yield from rec(r, remaining - 1, prefix)
+            prefix.pop()
+    yield from rec(0, k, [])
+
+
+class EvaluatorTables:
+    """Holds the lookup tables of the evaluator and evaluates hands given as card ids."""
+    def __init__(self, flush, multiset, values=STANDARD_VALUES):
+        """
+        Initializes the tables from already built arrays (or any read-only buffer of 64-bit integers).
+        :param flush: sequence of integers.
+        :param multiset: sequence of integers.
+        :param values: tuple of integers.
+        The values of the ranks of the deck, in ascending order.
+        """
+        self.values = tuple(values)
+        self.flush = flush
+        self.multiset = multiset
+        self._rank_offset = self.values[0] - 2  # card ids are always numbered as in the 52 card deck
+        self._bases, self._keys = _multiset_keys(len(self.values))
+
+    @staticmethod
+    def build(values=STANDARD_VALUES):
+        """Builds new tables for a deck whose ranks have the given values. Takes about a second."""
+        return EvaluatorTables(*build_arrays(values), values=values)
+
+    @property
+    def nbytes(self):
+        return 8 * (len(self.flush) + len(self.multiset))
+
+    def evaluate(self, card_ids):
+        """
+        Returns the strength of the best hand of 5 cards (or less) among the cards provided.
+        :param card_ids: sequence of at most 7 distinct card ids.
+        :return: integer.
+        """
+        offset = self._rank_offset
+        ranks = sorted(c % N_RANKS - offset for c in card_ids)
+        n_cards = len(ranks)
+        keys = self._keys
+        index = self._bases[n_cards]
+        for i, r in enumerate(ranks, 1):
+            index += keys[i][r]
+        strength = self.multiset[index]
+        if n_cards >= 5:
+            masks = [0, 0, 0, 0]
+            for c in card_ids:
+                masks[c // N_RANKS] |= 1 << (c % N_RANKS - offset)
+            flush = self.flush
+            for mask in masks:
+                if flush[mask] > strength:
+                    strength = flush[mask]
+        return strength
+
+
+class SharedTables:
+    """Publishes evaluator tables once in a shared memory block so that other processes can attach to them
+    read-only without copying them. The block is freed when the context manager exits (or on close())."""
+    def __init__(self, tables=None):
+        """
+        :param tables: EvaluatorTables or None.
+        The tables to publish. If None, the tables of the current process are published.
+        """
+        from multiprocessing import shared_memory  # imported here so that importing this module stays cheap
+        if tables is None:
+            tables = get_tables()
+        self._shm = shared_memory.SharedMemory(create=True, size=tables.nbytes)
+        view = memoryview(self._shm.buf).cast("q")
+        view[:len(tables.flush)] = memoryview(tables.flush)
+        view[len(tables.flush):] = memoryview(tables.multiset)
+        view.release()
+        # everything a worker needs to attach to the tables. Picklable.
+        self.handle = (self._shm.name, len(tables.flush), len(tables.multiset), tables.values)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Frees the shared memory block. The workers attached to it must have stopped using it."""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def _attach_shared_memory(name):
+    """Attaches to an existing shared memory block. The workers of a pool share the resource tracker of the process
+    which created the block, so the block is only destroyed by SharedTables.close()."""
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python >= 3.13
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+_tables = None  # EvaluatorTables of the current process. Built (or attached) on first use.
+_deck_tables = {}  # values -> EvaluatorTables of the decks with other ranks (eg. the 32 card deck)
+_attached_shm = None  # keeps the attached shared memory block alive
+
+
+def attach_shared_tables(handle):
+    """
+    Makes the current process use the tables published by a SharedTables instance. Meant to be used as the
+    initializer of the workers of a process pool. The tables are mapped read-only and are never copied.
+    :param handle: tuple.
+    The handle attribute of a SharedTables instance.
+    :return: EvaluatorTables.
+    """
+    global _tables, _attached_shm
+    name, n_flush, n_multiset, values = handle
+    _attached_shm = _attach_shared_memory(name)
+    view = memoryview(_attached_shm.buf)[:8 * (n_flush + n_multiset)].cast("q").toreadonly()
+    _tables = EvaluatorTables(view[:n_flush], view[n_flush:], values)
+    return _tables
+
+
+def _code_hash():
+    """Returns a short hash of the source code of this module. Used to version the cache files."""
+    import hashlib
+    with open(__file__, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def cache_path(values=STANDARD_VALUES):
+    """Returns the path of the cache file of the tables built for a deck whose ranks have the given values."""
+    values_tag = "{}-{}".format(values[0], values[-1])
+    return os.path.join(CACHE_DIR, "evaluator_{}_{}.bin".format(values_tag, _code_hash()))
+
+
+def save_tables(tables, path):
+    """
+    Writes the tables to a cache file. The file is written atomically: a concurrent reader sees either no file or a
+    complete file.
+    :param tables: EvaluatorTables.
+    :param path: string.
+    :return: None.
+    """
+    import tempfile
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_CACHE_HEADER.pack(_CACHE_MAGIC, len(tables.flush), len(tables.multiset)))
+            f.write(memoryview(tables.flush).cast("B"))
+            f.write(memoryview(tables.multiset).cast("B"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_tables(path, values=STANDARD_VALUES):
+    """
+    Maps a cache file written by save_tables() in memory. The tables are read lazily by the operating system and
+    are shared with every other process mapping the same file. Raises a ValueError if the file is corrupted.
+    :param path: string.
+    :param values: tuple of integers.
+    :return: EvaluatorTables.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, n_flush, n_multiset = _CACHE_HEADER.unpack_from(mapped)
+    if magic != _CACHE_MAGIC or len(mapped) != _CACHE_HEADER.size + 8 * (n_flush + n_multiset):
+        mapped.close()
+        raise ValueError("Corrupted evaluator cache file: {}".format(path))
+    view = memoryview(mapped)[_CACHE_HEADER.size:].cast("q")
+    return EvaluatorTables(view[:n_flush], view[n_flush:], values)
+
+
+def load_or_build_tables(values=STANDARD_VALUES):
+    """
+    Returns the tables for a deck whose ranks have the given values. They are loaded from the cache file when it
+    exists, otherwise they are built and the cache file is written for the next runs.
+    :param values: tuple of integers.
+    :return: EvaluatorTables.
+    """
+    path = cache_path(values)
+    try:
+        return load_tables(path, values)
+    except (OSError, ValueError, struct.error):
+        pass
+    tables = EvaluatorTables.build(values)
+    try:
+        save_tables(tables, path)
+    except OSError:  # a read-only or full disk only costs the build time at the next run
+        pass
+    return tables
+
+
+def get_tables(values=STANDARD_VALUES):
+    """
+    Returns the evaluator tables of the current process. They are loaded (or built) on first use only.
+    :param values: tuple of integers. The values of the ranks of the deck, in ascending order (eg. SHORT_DECK_VALUES).
+    The tables of a deck only accept the card ids of its ranks, and are smaller than the 52 card deck ones.
+    :return: EvaluatorTables.
+    """
+    global _tables
+    values = tuple(values)
+    if values != STANDARD_VALUES:
+        if values not in _deck_tables:
+            _deck_tables[values] = load_or_build_tables(values)
+        return _deck_tables[values]
+    if _tables is None:
+        _tables = load_or_build_tables()
+    return _tables
+
+
+def deck_values(card_ids):
+    """
+    Returns the values of the ranks of the smallest tables able to evaluate the cards of a deck: the interval from the
+    lowest to the highest value of the cards (eg. SHORT_DECK_VALUES for the 32 card deck).
+    :param card_ids: iterable of card ids.
+    :return: tuple of integers.
+    """
+    ranks = [c % N_RANKS for c in card_ids]
+    return tuple(range(min(ranks) + 2, max(ranks) + 3)) if ranks else STANDARD_VALUES
+
+
+def exhaustive_counts(n_cards, values=STANDARD_VALUES):
+    """
+    Counts the strengths of every combination of n_cards cards of the full deck whose ranks have the given values
+    (eg. the 201,376 combinations of 5 cards of the 32 card deck) without enumerating the combinations. The
+    combinations are grouped by multiset of ranks: a multiset with multiplicities m_r has prod(C(4, m_r)) suit
+    assignments. The assignments with a flush are counted by their suited ranks S (at most one suit has 5 cards or
+    more in 7 cards): 4 * prod(C(3, m_r - 1) for r in S) * prod(C(3, m_r) for r not in S) of them. The other
+    assignments all have the strength of the multiset.
+    :param n_cards: integer. At most MAX_CARDS.
+    :param values: tuple of integers.
+    :return: collections.Counter. strength -> number of combinations.
+    """
+    tables = get_tables(values)
+    bases, keys = tables._bases, tables._keys
+    counts = collections.Counter()
+    for ranks in _sorted_multisets(len(tables.values), n_cards):
+        strength = tables.multiset[bases[n_cards] + sum(keys[i][r] for i, r in enumerate(ranks, 1))]
+        multiplicities = collections.Counter(ranks)
+        n_assignments = math.prod(math.comb(N_SUITS, m) for m in multiplicities.values())
+        n_flushes = 0
+        for n_suited in range(5, len(multiplicities) + 1):
+            for suited in itertools.combinations(multiplicities, n_suited):
+                n_ways = N_SUITS * math.prod(math.comb(N_SUITS - 1, m - (r in suited))
+                                             for r, m in multiplicities.items())
+                if n_ways:
+                    mask = sum(1 << r for r in suited)
+                    counts[max(tables.flush[mask], strength)] += n_ways
+                    n_flushes += n_ways
+        counts[strength] += n_assignments - n_flushes
+    return counts
+
+
+def evaluate(card_ids):
+    """
+    Returns the strength of the best hand of 5 cards (or less) among the cards provided, using the tables of the
+    current process.
+    :param card_ids: sequence of at most 7 distinct card ids, or poker.CardSet.
+    :return: integer.
+    """
+    if hasattr(card_ids, "ids"):  # poker.CardSet
+        card_ids = card_ids.ids()
+    return get_tables().evaluate(card_ids)
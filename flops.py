@@ -0,0 +1,227 @@
+"""Flop index: how a given hero hand fares on every flop.
+
+The flops of a hero hand which only differ by a permutation of the suits preserving the hero cards are equivalent
+(eg. for "AsKs", "Qh7h2h" and "Qd7d2d", but not "Qs7s2s"). These classes of (hero, flop) pairs are the canonical
+scenarios of store.canonical_scenario(). For a given hero hand, a FlopTable stores for each of them:
+- the weight: number of flops of the class,
+- the category of the hand made by the hero on the flop,
+- the equity of the hero against a random hand when all the cards are dealt (share of the pot).
+lookup() returns the row of the class of a flop. The table also aggregates the rows by flop texture: the 22,100 flops
+fall into 1,755 classes of flops which only differ by any permutation of the suits, and texture_lookup() and report()
+return the average equity and the distribution of the categories of the hero over the flops of a texture.
+Once built and saved, the reports are lookups.
+Example usage :
+table = FlopTable.build(simulation.card_ids_from_string("AsKs"), n_samples=500, engine=engine)
+table.save("AsKs.flops")
+row = FlopTable.load("AsKs.flops").lookup(game.board.cards[:3])
+print(row["equity"], row["categories"])
+"""
+import struct
+import itertools
+
+import evaluator
+import simulation
+from store import canonical_scenario, SUIT_PERMUTATIONS
+from tools import RunningSeries
+
+_canonical_flops = None  # dictionary: mask of a flop -> index of its class. Built on first use.
+_flop_classes = None  # list of the canonical flops (sorted tuples of card ids), in ascending order
+
+
+def _build_canonical_flops():
+    global _canonical_flops, _flop_classes
+    n_ranks = evaluator.N_RANKS
+    flop_of_mask = {}
+    for flop in itertools.combinations(range(evaluator.N_CARDS), 3):
+        mask = (1 << flop[0]) | (1 << flop[1]) | (1 << flop[2])
+        flop_of_mask[mask] = min(tuple(sorted(permutation[c // n_ranks] * n_ranks + c % n_ranks for c in flop))
+                                 for permutation in SUIT_PERMUTATIONS)
+    _flop_classes = sorted(set(flop_of_mask.values()))
+    class_index = {flop: i for i, flop in enumerate(_flop_classes)}
+    _canonical_flops = {mask: class_index[flop] for mask, flop in flop_of_mask.items()}
+
+
+def flop_classes():
+    """Returns the list of the 1,755 canonical flops (sorted tuples of 3 card ids)."""
+    if _flop_classes is None:
+        _build_canonical_flops()
+    return _flop_classes
+
+
+def flop_class_index(cards):
+    """
+    Returns the index of the class of a flop in flop_classes(). The index is looked up in a table of the 22,100 flops.
+    :param cards: sequence of 3 cards (Card objects, eg. Board.cards[:3]) or of 3 card ids.
+    :return: integer.
+    """
+    if _canonical_flops is None:
+        _build_canonical_flops()
+    mask = 0
+    for card in cards:
+        mask |= 1 << (card if isinstance(card, int) else card.id)
+    return _canonical_flops[mask]
+
+
+def canonical_flop(cards):
+    """Returns the canonical flop (sorted tuple of 3 card ids) of the class of a flop. See flop_class_index()."""
+    return flop_classes()[flop_class_index(cards)]
+
+
+def flop_equities_unit(hero_ids, flops, n_samples, seed, key):
+    """Work unit of FlopTable.build(). Returns the equities of the hero against a random hand on each flop."""
+    rng = simulation.unit_rng(seed, *key)
+    return [(simulation.simulate_earnings(hero_ids, 2, n_samples, rng, board_ids=flop).mean + 1) / 2
+            for flop in flops]
+
+
+class FlopTable:
+    """The flop table of a hero hand: a row per class of (hero, flop) pairs, and the texture rows indexed like
+    flop_classes()."""
+    _HEADER = struct.Struct("<8s2BII")  # magic, hero card ids, number of samples per flop, number of scenario rows
+    _SCENARIO_ROW = struct.Struct("<5BHfB")  # canonical hero and flop card ids, weight, equity, category
+    _ROW = struct.Struct("<Hf{}H".format(len(evaluator.CATEGORY_NAMES)))  # weight, equity, count of each category
+    _MAGIC = b"PKRFLOP2"
+
+    def __init__(self, hero_ids, n_samples, scenario_rows, weights, equities, category_counts):
+        """
+        :param hero_ids: (integer, integer).
+        :param n_samples: integer. Number of deals simulated to estimate each equity.
+        :param scenario_rows: dictionary (canonical hero ids, canonical flop ids) -> (weight, equity, category). The
+        classes of (hero, flop) pairs, see store.canonical_scenario().
+        :param weights: list of integers. Number of possible flops of each texture.
+        :param equities: list of floats. Average equity of the hero on the flops of each texture.
+        :param category_counts: list of lists of integers. Number of flops of each texture where the hero makes a hand
+        of each category.
+        """
+        self.hero_ids = tuple(hero_ids)
+        self.n_samples = n_samples
+        self.scenario_rows = scenario_rows
+        self.weights = weights
+        self.equities = equities
+        self.category_counts = category_counts
+
+    @staticmethod
+    def build(hero_ids, n_samples=1000, engine=None, seed=None, unit_size=50):
+        """
+        Builds the table of a hero hand.
+        :param hero_ids: (integer, integer).
+        :param n_samples: integer. Number of deals simulated for each class of (hero, flop) pairs.
+        :param engine: simulation.Engine or None. If provided, the equities are computed by the engine.
+        :param seed: integer or None.
+        :param unit_size: integer. Number of flops per work unit.
+        :return: FlopTable.
+        """
+        evaluate = evaluator.get_tables().evaluate
+        hero_ids = list(hero_ids)
+        n_classes = len(flop_classes())
+        weights = [0] * n_classes
+        category_counts = [[0] * len(evaluator.CATEGORY_NAMES) for i in range(n_classes)]
+        # the flops are first grouped by class of (hero, flop) pair: they all have the same equity
+        hero_flop_classes = {}
+        flop_categories = {}
+        for flop in itertools.combinations(simulation.remaining_card_ids(hero_ids), 3):
+            flop_index = flop_class_index(flop)
+            weights[flop_index] += 1
+            category = evaluator.category(evaluate(hero_ids + list(flop)))
+            category_counts[flop_index][category] += 1
+            scenario = canonical_scenario(hero_ids, 2, flop)
+            hero_flop_classes.setdefault(scenario, []).append(flop_index)
+            flop_categories[scenario] = category
+
+        scenarios = list(hero_flop_classes)
+        units = []
+        for i in range(0, len(scenarios), unit_size):
+            chunk = scenarios[i:i + unit_size]
+            for hero in set(s[0] for s in chunk):  # the canonical hero cards may differ between the scenarios
+                units.append((hero, [s[2] for s in chunk if s[0] == hero], n_samples, seed, ("flops", i, hero)))
+        map_function = engine.map if engine is not None else lambda f, args_list: [f(*args) for args in args_list]
+        equity_of_scenario = {}
+        for unit, equities in zip(units, map_function(flop_equities_unit, units)):
+            hero, flops = unit[0], unit[1]
+            for flop, equity in zip(flops, equities):
+                equity_of_scenario[(hero, 2, flop, ())] = equity
+
+        scenario_rows = {}
+        equity_series = [RunningSeries() for i in range(n_classes)]
+        for scenario, flop_indexes in hero_flop_classes.items():
+            equity = equity_of_scenario[scenario]
+            scenario_rows[scenario[0], scenario[2]] = (len(flop_indexes), equity, flop_categories[scenario])
+            for flop_index in flop_indexes:
+                equity_series[flop_index].add(equity)
+        equities = [series.mean if series.n else 0. for series in equity_series]
+        return FlopTable(hero_ids, n_samples, scenario_rows, weights, equities, category_counts)
+
+    def lookup(self, cards):
+        """
+        Returns the row of a flop for the hero: the row of the class of the (hero, flop) pair. Raises a ValueError if
+        the flop is not 3 distinct cards or shares a card with the hero.
+        :param cards: sequence of 3 cards or card ids.
+        :return: dictionary with the keys "flop" (canonical flop of the class), "weight" (number of flops of the
+        class), "equity" and "categories" (dictionary category name -> 1. for the category made by the hero).
+        """
+        flop = [card if isinstance(card, int) else card.id for card in cards]
+        if len(set(flop)) != 3 or set(flop) & set(self.hero_ids):
+            raise ValueError("Invalid flop {} for the hero {}.".format(simulation.card_ids_to_string(flop),
+                                                                      simulation.card_ids_to_string(self.hero_ids)))
+        hero, n_players, canonical_flop_ids, dead = canonical_scenario(self.hero_ids, 2, flop)
+        weight, equity, category = self.scenario_rows[hero, canonical_flop_ids]
+        return {"flop": simulation.card_ids_to_string(canonical_flop_ids), "weight": weight, "equity": equity,
+                "categories": {evaluator.CATEGORY_NAMES[category]: 1.}}
+
+    def texture_lookup(self, cards):
+        """
+        Returns the texture row of a flop: the average over the flops of its texture (see row()).
+        :param cards: sequence of 3 cards or card ids.
+        :return: dictionary.
+        """
+        return self.row(flop_class_index(cards))
+
+    def row(self, flop_index):
+        """
+        Returns the row of a flop texture.
+        :param flop_index: integer. Index in flop_classes().
+        :return: dictionary with the keys "flop" (canonical flop), "weight", "equity" (average over the flops of the
+        texture) and "categories" (dictionary category name -> probability of the hero making this category on the
+        flops of the texture).
+        """
+        weight = self.weights[flop_index]
+        return {"flop": simulation.card_ids_to_string(flop_classes()[flop_index]), "weight": weight,
+                "equity": self.equities[flop_index],
+                "categories": {name: count / weight for name, count in
+                               zip(evaluator.CATEGORY_NAMES, self.category_counts[flop_index]) if count}}
+
+    def report(self):
+        """Returns the rows of the possible flop textures, sorted by descending equity."""
+        rows = [self.row(i) for i in range(len(self.weights)) if self.weights[i]]
+        rows.sort(key=lambda row: row["equity"], reverse=True)
+        return rows
+
+    def save(self, path):
+        """Writes the table to a compact binary file (12 bytes per class of (hero, flop) pairs then 24 bytes per flop
+        texture)."""
+        with open(path, "wb") as f:
+            f.write(FlopTable._HEADER.pack(FlopTable._MAGIC, *self.hero_ids, self.n_samples, len(self.scenario_rows)))
+            for (hero, flop), (weight, equity, category) in sorted(self.scenario_rows.items()):
+                f.write(FlopTable._SCENARIO_ROW.pack(*hero, *flop, weight, equity, category))
+            for weight, equity, counts in zip(self.weights, self.equities, self.category_counts):
+                f.write(FlopTable._ROW.pack(weight, equity, *counts))
+
+    @staticmethod
+    def load(path):
+        """Reads a table written by save(). Raises a ValueError if the file is not a flop table."""
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, hero_1, hero_2, n_samples, n_scenario_rows = FlopTable._HEADER.unpack_from(data)
+        if magic != FlopTable._MAGIC:
+            raise ValueError("{} is not a flop table.".format(path))
+        scenario_rows = {}
+        start = FlopTable._HEADER.size
+        end = start + n_scenario_rows * FlopTable._SCENARIO_ROW.size
+        for *cards, weight, equity, category in FlopTable._SCENARIO_ROW.iter_unpack(data[start:end]):
+            scenario_rows[tuple(cards[:2]), tuple(cards[2:])] = (weight, equity, category)
+        weights, equities, category_counts = [], [], []
+        for weight, equity, *counts in FlopTable._ROW.iter_unpack(data[end:]):
+            weights.append(weight)
+            equities.append(equity)
+            category_counts.append(counts)
+        return FlopTable((hero_1, hero_2), n_samples, scenario_rows, weights, equities, category_counts)
@@ -0,0 +1,210 @@
+"""Importance sampling of the frequencies of the rare hand names (the quantity of Q1.py and Q2.py).
+
+With uniform draws, a category of probability p needs about 1/p draws for a single hit, so the rare categories
+("Four of a kind", "Straight flush", "Royal straight flush") are not estimated by Q2.py. Here the draws come from a
+mixture of proposals which each force the core of a category into the drawn cards:
+- "uniform": the uniform draw of Q2.py (no core). It keeps the frequent categories well estimated.
+- "flush": 5 cards of a random suit.
+- "straight": one card of each rank of a random straight (eg. 5 6 7 8 9).
+- "straight_flush": the 5 cards of a random straight of a random suit.
+- "four_of_a_kind": the 4 cards of a random rank.
+- "full_house": 3 cards of a random rank and 2 cards of another random rank.
+A proposal draws each of its cores (eg. the 5 cards of a straight) with the same probability, and the other cards are
+drawn uniformly among the rest of the deck. The density of a combination of cards under a proposal is
+(number of cores of the proposal contained in the combination) / (number of cores * number of ways to complete a core),
+so the density of the mixture is exact and each draw is weighted by (uniform density) / (mixture density). The weighted
+frequencies are unbiased, and their confidence ranges come from the variance of the weights.
+Example usage :
+estimates = estimate_categories(simulation.deck_card_ids(52), 5, 100000, seed=0)
+print(estimates["Royal straight flush"].mean, estimates["Royal straight flush"].confidence_range)
+"""
+import math
+import random
+
+import evaluator
+import simulation
+from tools import RunningSeries
+
+DEFAULT_MIXTURE = {"uniform": 0.3, "flush": 0.15, "straight": 0.15, "straight_flush": 0.15, "four_of_a_kind": 0.15,
+                   "full_house": 0.1}
+HAND_NAMES = evaluator.HAND_NAMES  # "Straight flush" excludes the royal ones
+
+
+def straight_windows(deck_ids):
+    """
+    Returns the straights which can be made with the cards of a deck.
+    :param deck_ids: sequence of card ids.
+    :return: list of tuples of 5 rank indexes (value - 2).
+    """
+    ranks = set(c % evaluator.N_RANKS for c in deck_ids)
+    windows = [tuple(range(low, low + 5)) for low in range(evaluator.N_RANKS - 4)
+               if all(r in ranks for r in range(low, low + 5))]
+    wheel = (12, 0, 1, 2, 3)  # "A 2 3 4 5"
+    if all(r in ranks for r in wheel):
+        windows.insert(0, wheel)
+    return windows
+
+
+class Proposal:
+    """A mixture of proposals drawing n_cards cards from a deck, with its exact density."""
+    def __init__(self, deck_ids, n_cards, mixture=None):
+        """
+        :param deck_ids: sequence of card ids.
+        :param n_cards: integer. Number of cards drawn.
+        :param mixture: dictionary proposal name -> weight, or None for DEFAULT_MIXTURE. The proposals whose core does
+        not fit in n_cards cards or which cannot be made with the deck are ignored, and the weights are normalised.
+        """
+        self.deck_ids = list(deck_ids)
+        self.n_cards = n_cards
+        n_ranks = evaluator.N_RANKS
+        self._rank_cards = {}
+        self._suit_cards = {}
+        for c in self.deck_ids:
+            self._rank_cards.setdefault(c % n_ranks, []).append(c)
+            self._suit_cards.setdefault(c // n_ranks, []).append(c)
+        self._windows = straight_windows(self.deck_ids)
+        self._quads = [r for r, cards in self._rank_cards.items() if len(cards) == evaluator.N_SUITS]
+        self._flushes = [s for s, cards in self._suit_cards.items() if len(cards) >= 5]
+        self._straight_flushes = [(s, w) for s in self._suit_cards for w in self._windows
+                                  if all(s * n_ranks + r in self.deck_ids for r in w)]
+        rank_sizes = {r: len(cards) for r, cards in self._rank_cards.items()}
+        self._flush_weights = [math.comb(len(self._suit_cards[s]), 5) for s in self._flushes]
+        self._window_weights = [math.prod(rank_sizes[r] for r in w) for w in self._windows]
+        # name -> (size of the core, number of cores)
+        cores = {"uniform": (0, 1),
+                 "flush": (5, sum(self._flush_weights)),
+                 "straight": (5, sum(self._window_weights)),
+                 "straight_flush": (5, len(self._straight_flushes)),
+                 "four_of_a_kind": (4, len(self._quads)),
+                 "full_house": (5, len(self._quads) * (len(self._quads) - 1) * math.comb(evaluator.N_SUITS, 3)
+                                * math.comb(evaluator.N_SUITS, 2))}
+        mixture = DEFAULT_MIXTURE if mixture is None else mixture
+        unknown = set(mixture) - set(cores)
+        if unknown:
+            raise ValueError("Unknown proposals {}. Available proposals: {}".format(sorted(unknown), list(cores)))
+        mixture = {name: weight for name, weight in mixture.items()
+                   if weight > 0 and cores[name][0] <= n_cards and cores[name][1] > 0}
+        if "uniform" not in mixture:
+            raise ValueError("The mixture needs a positive 'uniform' weight so that every combination can be drawn.")
+        total_weight = sum(mixture.values())
+        self.mixture = {name: weight / total_weight for name, weight in mixture.items()}
+        self._names = list(self.mixture)
+        self._weights = [self.mixture[name] for name in self._names]
+        n_deck = len(self.deck_ids)
+        self.uniform_density = 1 / math.comb(n_deck, n_cards)
+        # density of a combination under a proposal = its number of cores * _core_factors[name]
+        self._core_factors = {name: 1 / (cores[name][1] * math.comb(n_deck - cores[name][0], n_cards - cores[name][0]))
+                              for name in self._names}
+
+    def _draw_core(self, name, rng):
+        if name == "uniform":
+            return []
+        # the suits and the straights are drawn in proportion to their number of cores, so that every core has the same
+        # probability
+        if name == "flush":
+            suit = rng.choices(self._flushes, self._flush_weights)[0]
+            return rng.sample(self._suit_cards[suit], 5)
+        if name == "straight":
+            window = rng.choices(self._windows, self._window_weights)[0]
+            return [rng.choice(self._rank_cards[r]) for r in window]
+        if name == "straight_flush":
+            suit, window = rng.choice(self._straight_flushes)
+            return [suit * evaluator.N_RANKS + r for r in window]
+        if name == "four_of_a_kind":
+            return list(self._rank_cards[rng.choice(self._quads)])
+        if name == "full_house":
+            rank_3, rank_2 = rng.sample(self._quads, 2)
+            return rng.sample(self._rank_cards[rank_3], 3) + rng.sample(self._rank_cards[rank_2], 2)
+
+    def draw(self, rng=random):
+        """Returns n_cards distinct card ids drawn from the mixture."""
+        name = rng.choices(self._names, self._weights)[0]
+        core = self._draw_core(name, rng)
+        core_set = set(core)
+        return core + rng.sample([c for c in self.deck_ids if c not in core_set], self.n_cards - len(core))
+
+    def density(self, card_ids):
+        """Returns the probability of the combination of cards card_ids under the mixture."""
+        n_ranks = evaluator.N_RANKS
+        rank_counts = {}
+        suit_counts = {}
+        cards = set(card_ids)
+        for c in cards:
+            rank_counts[c % n_ranks] = rank_counts.get(c % n_ranks, 0) + 1
+            suit_counts[c // n_ranks] = suit_counts.get(c // n_ranks, 0) + 1
+        density = 0.
+        for name, weight in self.mixture.items():
+            if name == "uniform":
+                n_cores = 1
+            elif name == "flush":
+                n_cores = sum(math.comb(suit_counts.get(s, 0), 5) for s in self._flushes)
+            elif name == "straight":
+                n_cores = sum(math.prod(rank_counts.get(r, 0) for r in w) for w in self._windows)
+            elif name == "straight_flush":
+                n_cores = sum(1 for s, w in self._straight_flushes if all(s * n_ranks + r in cards for r in w))
+            elif name == "four_of_a_kind":
+                n_cores = sum(1 for r in self._quads if rank_counts.get(r, 0) == 4)
+            else:  # full_house: the cores are only drawn from the ranks with every suit in the deck
+                n_cores = sum(math.comb(rank_counts.get(r_3, 0), 3) * math.comb(rank_counts.get(r_2, 0), 2)
+                              for r_3 in self._quads for r_2 in self._quads if r_2 != r_3)
+            density += weight * n_cores * self._core_factors[name]
+        return density
+
+
+def sample_categories_weighted(proposal, n_stories, rng=random, results=None):
+    """
+    Draws n_stories combinations from the proposal and adds the weighted indicator of every hand name to the
+    RunningSeries of the results.
+    :param proposal: Proposal.
+    :param n_stories: integer.
+    :param rng: random.Random or the random module.
+    :param results: dictionary hand name -> RunningSeries, or None.
+    :return: dictionary hand name -> RunningSeries. The mean of a series is the estimated frequency of the hand name.
+    """
+    if results is None:
+        results = {name: RunningSeries() for name in HAND_NAMES}
+    evaluate = evaluator.get_tables().evaluate
+    sums = dict.fromkeys(HAND_NAMES, 0.)
+    squares_sums = dict.fromkeys(HAND_NAMES, 0.)
+    for i in range(n_stories):
+        card_ids = proposal.draw(rng)
+        name = evaluator.hand_name(evaluate(card_ids))
+        weight = proposal.uniform_density / proposal.density(card_ids)
+        sums[name] += weight
+        squares_sums[name] += weight * weight
+    for name in HAND_NAMES:
+        results[name].merge(RunningSeries.from_state([n_stories, sums[name], squares_sums[name]]))
+    return results
+
+
+def importance_unit(deck_ids, n_cards, n_stories, mixture, seed, key):
+    """Work unit of estimate_categories(). Returns the states of the RunningSeries of every hand name."""
+    results = sample_categories_weighted(Proposal(deck_ids, n_cards, mixture), n_stories,
+                                         simulation.unit_rng(seed, *key))
+    return {name: series.state for name, series in results.items()}
+
+
+def estimate_categories(deck_ids, n_cards, n_stories, mixture=None, engine=None, seed=None,
+                        unit_size=simulation.UNIT_SIZE, key=()):
+    """
+    Estimates the frequencies of the hand names among the draws of n_cards cards of the deck by importance sampling.
+    :param deck_ids: sequence of card ids.
+    :param n_cards: integer.
+    :param n_stories: integer. Number of draws.
+    :param mixture: dictionary proposal name -> weight, or None. See Proposal.
+    :param engine: simulation.Engine or None. If provided, the work units are run by the engine.
+    :param seed: integer or None.
+    :param unit_size: integer. Number of draws per work unit.
+    :param key: tuple. Added to the keys of the work units, so that successive calls with the same seed draw different
+    combinations.
+    :return: dictionary hand name -> RunningSeries.
+    """
+    deck_ids = list(deck_ids)
+    units = [(deck_ids, n_cards, n, mixture, seed, ("importance",) + tuple(key) + (i,))
+             for i, n in enumerate(simulation.split_stories(n_stories, unit_size))]
+    states_list = engine.map(importance_unit, units) if engine is not None else [importance_unit(*u) for u in units]
+    results = {name: RunningSeries() for name in HAND_NAMES}
+    for states in states_list:
+        for name, state in states.items():
+            results[name].merge(RunningSeries.from_state(state))
+    return results
@@ -0,0 +1,190 @@
+"""The 169 x 169 matrix of the heads-up preflop equities of every hand class against every other (eg. "AKs" vs "QQ").
+
+The equity of a hand class against another one is the average share of the pot of the first class, over every pair of
+non-conflicting suit combos of the two classes (each pair has the same weight) and every board. It is estimated by
+Monte Carlo: each deal draws a pair of combos uniformly then a board. Only the upper triangle of the matrix is
+simulated since equity(b, a) = 1 - equity(a, b), and the diagonal is 0.5.
+
+The build is split into work units of class pairs. The result of each unit is written to a work directory as soon as it
+is computed, so an interrupted build resumes where it stopped. The matrix is saved as a binary file of 169 x 169
+float32, and a lookup is an index computation.
+Example usage :
+with simulation.Engine(workers=8) as engine:
+    matrix = MatchupMatrix.build(n_stories=10000, work_directory="matchups_work", engine=engine, seed=0)
+matrix.save("matchups.bin")
+print(MatchupMatrix.load("matchups.bin").equity("AKs", "QQ"))
+"""
+import os
+import json
+import array
+import random
+import struct
+
+import evaluator
+import simulation
+from sweep import write_json_atomically
+from tools import RunningSeries
+
+HAND_CLASSES = simulation.all_hand_classes()
+CLASS_INDEX = {hand_class: i for i, hand_class in enumerate(HAND_CLASSES)}
+
+
+def simulate_matchup(class_1, class_2, n_stories, rng=random):
+    """
+    Returns the RunningSeries of the share of the pot of class_1 against class_2 (1 for a win, 0.5 for a tie, 0 for a
+    loss) over n_stories heads-up deals.
+    :param class_1: string.
+    :param class_2: string.
+    :param n_stories: integer.
+    :param rng: random.Random or the random module.
+    :return: RunningSeries.
+    """
+    evaluate = evaluator.get_tables().evaluate
+    combo_pairs = [(list(combo_1), list(combo_2)) for combo_1 in simulation.hand_class_combos(class_1)
+                   for combo_2 in simulation.hand_class_combos(class_2) if not set(combo_1) & set(combo_2)]
+    remaining = {pair_index: simulation.remaining_card_ids(combo_1, combo_2)
+                 for pair_index, (combo_1, combo_2) in enumerate(combo_pairs)}
+    n_wins = n_ties = 0
+    for i in range(n_stories):
+        pair_index = rng.randrange(len(combo_pairs))
+        combo_1, combo_2 = combo_pairs[pair_index]
+        board = rng.sample(remaining[pair_index], 5)
+        strength_1, strength_2 = evaluate(combo_1 + board), evaluate(combo_2 + board)
+        if strength_1 > strength_2:
+            n_wins += 1
+        elif strength_1 == strength_2:
+            n_ties += 1
+    return RunningSeries.from_state([n_stories, n_wins + n_ties / 2, n_wins + n_ties / 4])
+
+
+def matchups_unit(class_pairs, n_stories, seed, key):
+    """Work unit of MatchupMatrix.build(). Returns the states of the RunningSeries of each class pair."""
+    rng = simulation.unit_rng(seed, *key)
+    return [simulate_matchup(class_1, class_2, n_stories, rng).state for class_1, class_2 in class_pairs]
+
+
+class MatchupMatrix:
+    """The heads-up equities of the 169 hand classes against each other."""
+    _HEADER = struct.Struct("<8sII")  # magic, number of classes, number of deals per class pair
+    _MAGIC = b"PKRMATCH"
+
+    def __init__(self, equities, n_stories):
+        """
+        :param equities: array of 169 * 169 floats. equities[i * 169 + j] is the equity of the class i against the
+        class j (classes ordered like HAND_CLASSES).
+        :param n_stories: integer. Number of deals simulated per class pair.
+        """
+        self.equities = equities
+        self.n_stories = n_stories
+
+    def equity(self, class_1, class_2):
+        """Returns the heads-up equity (share of the pot) of class_1 against class_2."""
+        return self.equities[CLASS_INDEX[class_1] * len(HAND_CLASSES) + CLASS_INDEX[class_2]]
+
+    def equity_against_random(self, hand_class):
+        """Returns the equity of a hand class against a random hand, i.e. the average of its row of the matrix
+        weighted by the number of non-conflicting combos of each opponent class."""
+        combos = simulation.hand_class_combos(hand_class)
+        total_weight = total = 0
+        for other_class in HAND_CLASSES:
+            weight = sum(1 for combo_1 in combos for combo_2 in simulation.hand_class_combos(other_class)
+                         if not set(combo_1) & set(combo_2))
+            total_weight += weight
+            total += weight * self.equity(hand_class, other_class)
+        return total / total_weight
+
+    def equity_against_random_variance(self, hand_class):
+        """Returns an upper bound of the variance of the Monte Carlo error of equity_against_random(). The share of the
+        pot of a deal is between 0 and 1, so the variance of the estimate of an equity e is at most e * (1 - e) divided
+        by the number of deals. The diagonal is exact."""
+        combos = simulation.hand_class_combos(hand_class)
+        total_weight = total = 0
+        for other_class in HAND_CLASSES:
+            weight = sum(1 for combo_1 in combos for combo_2 in simulation.hand_class_combos(other_class)
+                         if not set(combo_1) & set(combo_2))
+            total_weight += weight
+            if other_class != hand_class:
+                equity = self.equity(hand_class, other_class)
+                total += weight ** 2 * equity * (1 - equity) / self.n_stories
+        return total / total_weight ** 2
+
+    @staticmethod
+    def build(n_stories=10000, work_directory=None, engine=None, seed=None, unit_size=50):
+        """
+        Builds the matrix.
+        :param n_stories: integer. Number of deals per class pair.
+        :param work_directory: string or None. Directory where the result of each work unit is written. A build with
+        the same parameters and the same work directory resumes from the units already computed.
+        :param engine: simulation.Engine or None. If provided, the work units are run by the engine.
+        :param seed: integer or None.
+        :param unit_size: integer. Number of class pairs per work unit.
+        :return: MatchupMatrix.
+        """
+        n_classes = len(HAND_CLASSES)
+        class_pairs = [(HAND_CLASSES[i], HAND_CLASSES[j]) for i in range(n_classes) for j in range(i + 1, n_classes)]
+        units = [(class_pairs[start:start + unit_size], n_stories, seed, ("matchups", start))
+                 for start in range(0, len(class_pairs), unit_size)]
+        results = {}  # class pair -> state of the RunningSeries
+        missing_units = []
+        for unit in units:
+            path = MatchupMatrix._unit_path(work_directory, unit)
+            if path is not None and os.path.exists(path):
+                with open(path) as f:
+                    results.update(zip(unit[0], json.load(f)))
+            else:
+                missing_units.append(unit)
+        if work_directory is not None:
+            os.makedirs(work_directory, exist_ok=True)
+        batch_size = engine.workers if engine is not None else 1
+        for start in range(0, len(missing_units), batch_size):  # the results are saved after every batch
+            batch = missing_units[start:start + batch_size]
+            states_list = engine.map(matchups_unit, batch) if engine is not None else \
+                [matchups_unit(*unit) for unit in batch]
+            for unit, states in zip(batch, states_list):
+                results.update(zip(unit[0], states))
+                if work_directory is not None:
+                    write_json_atomically(states, MatchupMatrix._unit_path(work_directory, unit))
+
+        equities = array.array("f", [0.5] * n_classes ** 2)
+        for (class_1, class_2), state in results.items():
+            equity = RunningSeries.from_state(state).mean
+            equities[CLASS_INDEX[class_1] * n_classes + CLASS_INDEX[class_2]] = equity
+            equities[CLASS_INDEX[class_2] * n_classes + CLASS_INDEX[class_1]] = 1 - equity
+        return MatchupMatrix(equities, n_stories)
+
+    @staticmethod
+    def _unit_path(work_directory, unit):
+        if work_directory is None:
+            return None
+        class_pairs, n_stories, seed, key = unit
+        return os.path.join(work_directory, "unit_{}_{}_{}_{}.json".format(key[1], len(class_pairs), n_stories, seed))
+
+    def save(self, path):
+        """Writes the matrix to a binary file (header then 169 * 169 little-endian float32)."""
+        with open(path, "wb") as f:
+            f.write(MatchupMatrix._HEADER.pack(MatchupMatrix._MAGIC, len(HAND_CLASSES), self.n_stories))
+            equities = array.array("f", self.equities)
+            if struct.pack("=f", 1.) != struct.pack("<f", 1.):  # big-endian machine
+                equities.byteswap()
+            f.write(equities.tobytes())
+
+    @staticmethod
+    def load(path):
+        """Reads a matrix written by save(). Raises a ValueError if the file is not a matchup matrix."""
+        with open(path, "rb") as f:
+            magic, n_classes, n_stories = MatchupMatrix._HEADER.unpack(f.read(MatchupMatrix._HEADER.size))
+            if magic != MatchupMatrix._MAGIC or n_classes != len(HAND_CLASSES):
+                raise ValueError("{} is not a matchup matrix.".format(path))
+            equities = array.array("f")
+            equities.frombytes(f.read())
+        if struct.pack("=f", 1.) != struct.pack("<f", 1.):
+            equities.byteswap()
+        return MatchupMatrix(equities, n_stories)
+
+
+if __name__ == "__main__":
+    with simulation.Engine(workers=os.cpu_count()) as matchups_engine:
+        matchup_matrix = MatchupMatrix.build(n_stories=10000, work_directory="matchups_work",
+                                             engine=matchups_engine, seed=0)
+    matchup_matrix.save("matchups.bin")
+    print(matchup_matrix.equity("AKs", "QQ"))
@@ -0,0 +1,200 @@
+"""The simulation of deals as a streaming pipeline of composable stages. It is the single code path of the deals of the
+simulation engine: simulation.simulate_earnings(), simulation.simulate_outcomes() and their work units chain these
+stages.
+1. deal(): a generator of chunks of deals. A deal is a list of card ids: the 5 cards of the board then the 2 private
+   cards of each player (the first player is the hero).
+2. evaluate_deals(): the strengths of the best hands of the players of every deal (see evaluator.py).
+3. showdown(): the earnings of the players of every deal. Each player bets 1 and the winners share the pot.
+4. a reducer: reduce_earnings() into a RunningSeries of the earnings of a player, reduce_outcomes() into the wins, ties
+   and losses of a player, or reduce_categories() into a histogram of the hand names of a player.
+record_outcomes() is an optional stage after evaluate_deals() which writes every deal to a recorder.Recorder.
+Each stage takes the iterator of the chunks of the previous stage and yields chunks, so at most a few chunks of deals
+are in memory whatever the number of deals, and any stage can be replaced (eg. another evaluator or another payout).
+The simulations which build their own deals (eg. variance.py) use the functions of a single deal: evaluate_deal() and
+deal_earnings(). The stages run in this process with run_stages(), or split into work units on a simulation.Engine
+with simulation.run_pipeline().
+Example usage :
+chunks = deal([simulation.card_ids_from_string("AsKs")], n_players=3, n_stories=100000, rng=random.Random(0))
+series = run_stages(chunks, EARNINGS_STAGES)
+print(series.mean, series.confidence_range)
+"""
+import random
+import collections
+
+import evaluator
+from tools import RunningSeries
+
+CHUNK_SIZE = 1000  # default number of deals of a chunk
+
+
+def deal(known_hands, n_players, n_stories, rng=random, board_ids=(), dead_ids=(), chunk_size=CHUNK_SIZE):
+    """
+    Yields chunks of deals where the first players always receive the same private cards while the other players
+    receive random cards.
+    :param known_hands: sequence of sequences of 2 card ids. The first hand is the hand of the hero.
+    :param n_players: integer. Number of players including the players with known hands.
+    :param n_stories: integer. Number of deals.
+    :param rng: random.Random or the random module.
+    :param board_ids: sequence of card ids. Cards already known on the board.
+    :param dead_ids: sequence of card ids. Cards known not to be in the deck.
+    :param chunk_size: integer. Number of deals per chunk.
+    :return: generator of lists of deals (lists of 5 + 2 * n_players card ids).
+    """
+    known_cards = [c for hand in known_hands for c in hand]
+    board_ids = list(board_ids)
+    remaining = evaluator.remaining_card_ids(known_cards, board_ids, dead_ids)
+    n_missing = 5 - len(board_ids)
+    n_drawn = n_missing + 2 * (n_players - len(known_hands))
+    for start in range(0, n_stories, chunk_size):
+        chunk = []
+        for i in range(min(chunk_size, n_stories - start)):
+            drawn = rng.sample(remaining, n_drawn)
+            chunk.append(board_ids + drawn[:n_missing] + known_cards + drawn[n_missing:])
+        yield chunk
+
+
+def evaluate_deal(cards, evaluate):
+    """
+    Returns the strengths of the players of a deal.
+    :param cards: list of card ids. The 5 cards of the board then the 2 private cards of each player.
+    :param evaluate: function. Strength of a list of card ids.
+    :return: list of integers.
+    """
+    board = cards[:5]
+    return [evaluate(cards[k:k + 2] + board) for k in range(5, len(cards), 2)]
+
+
+def evaluate_deals(chunks, evaluate=None):
+    """
+    Evaluator stage: yields for each chunk of deals the list of the strengths of the players of each deal.
+    :param chunks: iterable of lists of deals.
+    :param evaluate: function or None. Strength of a list of card ids. Default: the table evaluator.
+    :return: generator of lists of lists of integers.
+    """
+    if evaluate is None:
+        evaluate = evaluator.get_tables().evaluate
+    for chunk in chunks:
+        yield [evaluate_deal(cards, evaluate) for cards in chunk]
+
+
+def deal_earnings(strengths):
+    """
+    Returns the earnings of the players of a deal. Each player bets 1 and the winners share the pot: the earning is
+    n_players / n_winners - 1 for a winner and -1 otherwise.
+    :param strengths: list of integers. Strengths of the players.
+    :return: list of floats.
+    """
+    best = max(strengths)
+    win_earning = len(strengths) / strengths.count(best) - 1
+    return [win_earning if strength == best else -1. for strength in strengths]
+
+
+def showdown(chunks):
+    """
+    Showdown stage: yields for each chunk of strengths the list of the earnings of the players of each deal (see
+    deal_earnings()).
+    :param chunks: iterable of lists of lists of strengths.
+    :return: generator of lists of lists of floats.
+    """
+    for chunk in chunks:
+        yield [deal_earnings(strengths) for strengths in chunk]
+
+
+def record_outcomes(chunks, recorder, hero_key=0):
+    """
+    Recording stage: writes the winners, the hand categories and the earning of the hero (the first player) of every
+    deal to a recorder, and yields the chunks of strengths unchanged.
+    :param chunks: iterable of lists of lists of strengths.
+    :param recorder: recorder.Recorder.
+    :param hero_key: integer. Identifier of the hero written in the records.
+    :return: generator of lists of lists of integers.
+    """
+    for chunk in chunks:
+        for strengths in chunk:
+            best = max(strengths)
+            winners = 0
+            categories = 0
+            for p, strength in enumerate(strengths):
+                if strength == best:
+                    winners |= 1 << p
+                categories |= evaluator.category(strength) << (4 * p)
+            recorder.record(hero_key, winners, categories, deal_earnings(strengths)[0])
+        yield chunk
+
+
+def reduce_earnings(chunks, player=0, series=None):
+    """
+    Reducer: adds the earnings of a player to a RunningSeries, one chunk at a time.
+    :param chunks: iterable of lists of lists of earnings.
+    :param player: integer. Index of the player (0 for the hero).
+    :param series: RunningSeries or None.
+    :return: RunningSeries.
+    """
+    if series is None:
+        series = RunningSeries()
+    for chunk in chunks:
+        values = [earnings[player] for earnings in chunk]
+        series.merge(RunningSeries.from_state([len(values), sum(values), sum(v * v for v in values)]))
+    return series
+
+
+def reduce_outcomes(chunks, player=0, results=None):
+    """
+    Reducer: counts the wins, the ties and the losses of a player against the best of the other players, as in Q4.py
+    and QCM_Q1.py.
+    :param chunks: iterable of lists of lists of strengths.
+    :param player: integer. Index of the player (0 for the hero).
+    :param results: dictionary or None. If provided, the outcomes are added to the series of this dictionary.
+    :return: dictionary. The keys are "Win", "Lose" and "Tie" and the values are RunningSeries of the indicators of
+    each outcome.
+    """
+    if results is None:
+        results = {"Win": RunningSeries(), "Lose": RunningSeries(), "Tie": RunningSeries()}
+    for chunk in chunks:
+        outcomes = collections.Counter()
+        for strengths in chunk:
+            best_other = max(strengths[:player] + strengths[player + 1:], default=-1)
+            if strengths[player] > best_other:
+                outcomes["Win"] += 1
+            elif strengths[player] == best_other:
+                outcomes["Tie"] += 1
+            else:
+                outcomes["Lose"] += 1
+        for name, series in results.items():  # the indicators are 0 or 1, so the sums are the counts
+            series.merge(RunningSeries.from_state([len(chunk), outcomes[name], outcomes[name]]))
+    return results
+
+
+def reduce_categories(chunks, player=0, counts=None):
+    """
+    Reducer: counts the names of the best hands of a player, one chunk at a time.
+    :param chunks: iterable of lists of lists of strengths.
+    :param player: integer. Index of the player (0 for the hero).
+    :param counts: collections.Counter or None.
+    :return: collections.Counter.
+    """
+    if counts is None:
+        counts = collections.Counter()
+    for chunk in chunks:
+        strengths = collections.Counter(strengths[player] for strengths in chunk)
+        for strength, count in strengths.items():
+            counts[evaluator.hand_name(strength)] += count
+    return counts
+
+
+EARNINGS_STAGES = (evaluate_deals, showdown, reduce_earnings)
+OUTCOMES_STAGES = (evaluate_deals, reduce_outcomes)
+CATEGORIES_STAGES = (evaluate_deals, reduce_categories)
+
+
+def run_stages(chunks, stages):
+    """
+    Chains the stages on the chunks of deals and returns the result of the last stage (the reducer).
+    :param chunks: iterable of chunks, eg. returned by deal().
+    :param stages: sequence of functions taking the iterator of the chunks of the previous stage.
+    :return: result of the last stage.
+    """
+    stream = chunks
+    for stage in stages:
+        stream = stage(stream)
+    return stream
@@ -2,6 +2,8 @@
 import random
 import itertools
 
+import evaluator
+
 
 class Card:
     rank_to_value = {str(i): i for i in range(2, 10 + 1)}
@@ -21,6 +23,7 @@ class Card:
         assert suit in Card.valid_suits  # limiting the suit to the official suit whitelist
         self._rank = rank  # string. "2", "3", ..., "9", "10", "Jack", "Queen", "King", "Ace"
         self._suit = suit  # string. "Diamonds", "Hearts", "Clubs", "Spades"
+        self._id = Card.valid_suits.index(suit) * evaluator.N_RANKS + Card.rank_to_value[rank] - 2  # see Card.id
 
     # the rank and the suit are made immutable to avoid possible inconsistency bugs when interacting with the other
     # classes
@@ -51,6 +54,31 @@ class Card:
         """
         return Card.rank_to_value[self.rank]
 
+    @property
+    def id(self):
+        """
+        Returns the id of the card: an integer in [0, 52) equal to suit_index * 13 + (value - 2). It is the index of
+        the card in Deck.standard_52_card_deck() and the id used by CardSet and by the evaluator module.
+        :return: integer.
+        """
+        return self._id
+
+    @staticmethod
+    def id_from_description(rank, suit):
+        """
+        Returns the id of the card described by its rank and its suit, with a lookup in a precomputed table. Raises a
+        LookupError if the description is not valid.
+        :param rank: string or integer. The rank (eg. "Queen", "10" or 10) or the short rank (eg. "Q", "T").
+        :param suit: string. The suit (eg. "Diamonds") or the short suit (eg. "d").
+        :return: integer.
+        """
+        try:
+            return CARD_IDS[rank, suit]
+        except KeyError:
+            if isinstance(rank, int):
+                return Card.id_from_description(str(rank), suit)
+            raise LookupError("No card where rank='{}' and suit='{}'.".format(rank, suit))
+
     def __str__(self):  # the informal representation of a card is two character long (eg. "Tc" for "Ten of Clubs")
         return self.short_rank + self.short_suit
 
@@ -58,6 +86,19 @@ class Card:
         return "<Card: {} of {}>".format(self.rank, self.suit)
 
 
+# (rank, suit) -> card id, for every accepted description of a card: long or short rank (the short rank in upper or
+# lower case, eg. "K" or "k"), long or short suit (the short suit in lower or upper case, eg. "c" or "C"). It is the
+# only table of card ids: the short descriptions of simulation.py (eg. "Ks") are looked up here too.
+CARD_IDS = {}
+for _rank in Card.valid_ranks:
+    for _suit in Card.valid_suits:
+        _card = Card(_rank, _suit)
+        for _description in itertools.product((_card.rank, _card.short_rank, _card.short_rank.lower()),
+                                              (_card.suit, _card.short_suit, _card.short_suit.upper())):
+            CARD_IDS[_description] = _card.id
+del _rank, _suit, _card, _description
+
+
 class Deck:
     """Represents a deck of cards. A Deck is intended to be used as a classic Python list of cards while providing
     additional features like the ability to reset the deck to its original state, easy shuffling and manipulation.
@@ -103,6 +144,8 @@ class Deck:
     def __getitem__(self, item):
         if isinstance(item, str):
             return self._get_card(item[0], item[1])
+        if isinstance(item, tuple):  # eg. deck[("Queen", "Clubs")]
+            return self._get_card(*item)
         return self.cards.__getitem__(item)
 
     def __setitem__(self, item):
@@ -120,6 +163,21 @@ class Deck:
     def __contains__(self, item):
         return self.cards.__contains__(item)
 
+    @property
+    def card_set(self):
+        """Returns the cards currently present in the deck as a CardSet."""
+        return CardSet(self.cards)
+
+    def exclude(self, cards):
+        """
+        Removes cards from the deck (eg. dead cards). Cards which are not in the deck are ignored.
+        :param cards: CardSet or iterable of cards.
+        :return: None.
+        """
+        if not isinstance(cards, CardSet):
+            cards = CardSet(cards)
+        self.cards = [card for card in self.cards if card not in cards]
+
     def reset(self, shuffle=False):
         """
         Resets the deck to its original state. An optional shuffle option is provided.
@@ -138,6 +196,7 @@ class Deck:
     def _get_card(self, rank, suit):
         """
         Look for the first card in the deck with the provided rank and suit. Raises a LookUpError if not found.
+        The description is converted to a card id with a table lookup, then the cards of the deck are compared by id.
         :param rank: string or integer.
         The rank of the card being looked for. Can also be the short rank (eg. "T"). Integers are converted to string.
         :param suit: string.
@@ -145,26 +204,32 @@ class Deck:
         :return: Card.
         The first card of the deck with corresponding rank and suit.
         """
-        if isinstance(rank, int):
-            rank = str(rank)
+        card_id = Card.id_from_description(rank, suit)
         for card in self.cards:
-            if rank in (card.rank, card.short_rank) and suit in (card.suit, card.short_suit):
+            if card._id == card_id:
                 return card
         raise LookupError("No card where rank='{}' and suit='{}'.".format(rank, suit))
 
+    def _find_card(self, card_description):
+        """Returns the first card of the deck matching a description (see extract_card())."""
+        if isinstance(card_description, Card):
+            return self._get_card(card_description.short_rank, card_description.short_suit)
+        return self._get_card(*card_description[:2])
+
     def look_at_card(self, card_description=None):
         """
         Returns the card corresponding to card_description. Raises a LookUpError if there is no card corresponding to
         card_description.
         If card_description is None then the first card of the deck is returned. Returns None if the deck is empty.
         The returned card is not removed from the deck.
-        :param card_description: Iterable of at least 2 objects or None.
-        Can be a string (eg. "Qd") or a tuple/list (eg. ["Queen", "Diamonds"]).
+        :param card_description: Card, iterable of at least 2 objects or None.
+        Can be a string (eg. "Qd"), a tuple/list (eg. ["Queen", "Diamonds"]) or a Card (the card of the deck with the
+        same rank and suit is returned).
         :return: Card or None.
         """
         if card_description is None:
             return self.cards[0] if self.cards else None
-        return self._get_card(*card_description[:2])
+        return self._find_card(card_description)
 
     def extract_card(self, card_description=None):
         """
@@ -172,16 +237,30 @@ class Deck:
         is no card corresponding to card_description.
         If card_description is None then the first card of the deck is returned and removed. Returns None if the deck
         is empty.
-        :param card_description: Iterable of at least 2 objects or None.
-        Can be a string (eg. "Qd") or a tuple/list (eg. ["Queen", "Diamonds"]).
+        :param card_description: Card, iterable of at least 2 objects or None.
+        Can be a string (eg. "Qd"), a tuple/list (eg. ["Queen", "Diamonds"]) or a Card (the card of the deck with the
+        same rank and suit is extracted).
         :return: Card or None.
         """
         if card_description is None:
             return self.cards.pop(0) if self.cards else None
-        card = self._get_card(*card_description[:2])
+        card = self._find_card(card_description)
         self.cards.remove(card)
         return card
 
+    # Cards are immutable, so the standard decks all share the same card objects. The tuples of cards are built on
+    # first use only and are keyed by the number of cards of the deck.
+    _standard_cards = {}
+
+    @staticmethod
+    def _get_standard_cards(n_cards):
+        """Returns the cached tuple of the cards of the standard deck of n_cards cards (32 or 52)."""
+        if n_cards not in Deck._standard_cards:
+            excluded_ranks = [str(i) for i in range(2, 6 + 1)] if n_cards == 32 else []
+            Deck._standard_cards[n_cards] = tuple(Card(rank, suit) for suit in Card.valid_suits
+                                                  for rank in Card.valid_ranks if rank not in excluded_ranks)
+        return Deck._standard_cards[n_cards]
+
     @staticmethod
     def standard_32_card_deck(shuffled=False):
         """
@@ -190,9 +269,7 @@ class Deck:
         If True, the deck is created shuffled.
         :return: Deck.
         """
-        cards = [Card(rank, suit) for suit in Card.valid_suits
-                 for rank in Card.valid_ranks if rank not in (str(i) for i in range(2, 6 + 1))]
-        return Deck(cards, shuffled)
+        return Deck(Deck._get_standard_cards(32), shuffled)
 
     @staticmethod
     def standard_52_card_deck(shuffled=False):
@@ -202,28 +279,131 @@ class Deck:
         If True, the deck is created shuffled.
         :return: Deck.
         """
-        cards = [Card(rank, suit) for suit in Card.valid_suits for rank in Card.valid_ranks]
-        return Deck(cards, shuffled)
+        return Deck(Deck._get_standard_cards(52), shuffled)
+
+
+class CardSet:
+    """Represents an immutable set of cards as a 52-bit integer mask where the bit i is set when the card of id i
+    (see Card.id) is in the set. Union, intersection, difference and membership cost a single integer operation.
+    A CardSet is iterable like a list of cards, so it can be used wherever a list of cards is read (eg. Deck(),
+    Hand.best_from_cards()).
+    Example usage :
+    deck = Deck.standard_52_card_deck()
+    dead = CardSet([deck["As"], deck["Kd"]])
+    board = CardSet.from_ids([0, 1, 2])
+    if not dead & board:  # no conflict between the dead cards and the board
+        print(len(dead | board))  # <- 5
+    deck.exclude(dead)  # removes the dead cards from the deck
+    """
+    __slots__ = ("_mask",)
+
+    def __init__(self, cards=()):
+        """
+        :param cards: iterable of cards.
+        """
+        mask = 0
+        for card in cards:
+            mask |= 1 << card.id
+        self._mask = mask
+
+    @staticmethod
+    def from_mask(mask):
+        card_set = CardSet()
+        card_set._mask = mask
+        return card_set
+
+    @staticmethod
+    def from_ids(card_ids):
+        mask = 0
+        for i in card_ids:
+            mask |= 1 << i
+        return CardSet.from_mask(mask)
+
+    @property
+    def mask(self):
+        return self._mask
+
+    def ids(self):
+        """Returns the list of the ids of the cards of the set, in ascending order."""
+        mask = self._mask
+        ids = []
+        while mask:
+            low_bit = mask & -mask
+            ids.append(low_bit.bit_length() - 1)
+            mask ^= low_bit
+        return ids
+
+    def __len__(self):  # population count of the mask
+        return bin(self._mask).count("1")
+
+    def __iter__(self):
+        """Iterates through the cards of the set, in the order of their ids. The cards are the ones of the standard
+        decks."""
+        standard_cards = Deck._get_standard_cards(52)
+        return iter([standard_cards[i] for i in self.ids()])
+
+    def __contains__(self, item):
+        """item can be a Card or a card id."""
+        card_id = item if isinstance(item, int) else item.id
+        return bool(self._mask >> card_id & 1)
+
+    def __bool__(self):
+        return self._mask != 0
+
+    def __or__(self, other):
+        return CardSet.from_mask(self._mask | other.mask)
+
+    def __and__(self, other):
+        return CardSet.from_mask(self._mask & other.mask)
+
+    def __sub__(self, other):
+        return CardSet.from_mask(self._mask & ~other.mask)
+
+    def __eq__(self, other):
+        return isinstance(other, CardSet) and self._mask == other.mask
+
+    def __hash__(self):
+        return hash(self._mask)
+
+    def isdisjoint(self, other):
+        return not self._mask & other.mask
+
+    def __str__(self):
+        return "[" + " ".join(str(c) for c in self) + "]"
+
+    def __repr__(self):
+        return "<CardSet: " + str(self) + ">"
 
 
 class Hand:
-    """Represents a combination of 5 (or less) cards (Pair, Straight, Full House, etc)"""
+    """Represents a combination of 5 (or less) cards (Pair, Straight, Full House, etc). Hands are compared by strength
+    (eg. hand_1 > hand_2 if hand_1 beats hand_2, hand_1 == hand_2 in case of a tie).
+    The hands returned by best_from_cards() are evaluated with the lookup tables of the evaluator module: only the
+    strength is computed, and the tuple of the 5 best cards and the name are only built when they are accessed."""
+    __slots__ = ("_cards", "_source", "_strength", "_name")
+
     def __init__(self, cards=()):
         assert len(cards) <= 5
-        self._cards = tuple(cards)  # tuple of 5 cards or less
+        self._cards = tuple(cards)  # tuple of 5 cards or less. None until accessed for the hands of best_from_cards()
+        self._source = None  # cards the best hand was chosen from, for the hands of best_from_cards()
         self._strength = None  # integer representing the strength of the hand. The higher the stronger.
         self._name = None  # string (eg: "Two pairs", "Three of a kind", "Royal straight flush")
 
     @property
     def cards(self):
+        if self._cards is None:  # the first combination of 5 cards of the source with the strength of the hand
+            self._cards = next(cards for cards in itertools.combinations(self._source, 5)
+                               if Hand(cards).strength == self._strength)
+            self._source = None
         return self._cards
 
     @cards.setter
     def cards(self, new_cards):
-        if set(new_cards) != set(self._cards):
+        if self._cards is None or set(new_cards) != set(self._cards):
             self._strength = None
             self._name = None
         self._cards = tuple(new_cards)
+        self._source = None
 
     @property
     def strength(self):
@@ -234,11 +414,48 @@ class Hand:
     @property
     def name(self):
         if self._name is None:
-            self.compute_strength_and_name()
+            if self._strength is None:
+                self.compute_strength_and_name()
+            else:
+                self._name = evaluator.hand_name(self._strength)
         return self._name
 
+    # hands are compared by strength
+    def __eq__(self, other):
+        if not isinstance(other, Hand):
+            return NotImplemented
+        return self.strength == other.strength
+
+    def __ne__(self, other):
+        if not isinstance(other, Hand):
+            return NotImplemented
+        return self.strength != other.strength
+
+    def __lt__(self, other):
+        if not isinstance(other, Hand):
+            return NotImplemented
+        return self.strength < other.strength
+
+    def __le__(self, other):
+        if not isinstance(other, Hand):
+            return NotImplemented
+        return self.strength <= other.strength
+
+    def __gt__(self, other):
+        if not isinstance(other, Hand):
+            return NotImplemented
+        return self.strength > other.strength
+
+    def __ge__(self, other):
+        if not isinstance(other, Hand):
+            return NotImplemented
+        return self.strength >= other.strength
+
+    def __hash__(self):
+        return hash(self.strength)
+
     def __repr__(self):
-        return "{" + " ".join(str(c) for c in self._cards) + "} " + ",{}, strength={}".format(self.name, self.strength)
+        return "{" + " ".join(str(c) for c in self.cards) + "} " + ",{}, strength={}".format(self.name, self.strength)
 
     def compute_strength_and_name(self):
         """Computes the strength and determines the name of the hand. This implementation asserts that the number of
@@ -312,12 +529,24 @@ class Hand:
     @staticmethod
     def best_from_cards(cards):
         """
-        Returns the best hand of 5 cards from the cards provided. Works with any number of cards. Warning: this method
-        tries every possible combination of 5 cards, thus it is very inefficient especially for large (>5) number of
-        cards.
+        Returns the best hand of 5 cards from the cards provided. Works with any number of cards. Up to 7 distinct
+        cards, the strength is looked up by the evaluator module and no hand is built per combination. Otherwise (eg.
+        more than 7 cards or duplicated cards), this method tries every possible combination of 5 cards, which is very
+        inefficient.
         :param cards: iterable of cards.
         :return: Hand.
         """
+        cards = tuple(cards)
+        card_ids = [card.id for card in cards]
+        if len(cards) <= evaluator.MAX_CARDS and len(set(card_ids)) == len(cards):
+            hand = Hand.__new__(Hand)
+            if len(cards) <= 5:  # the hand is made of all the cards
+                hand._cards, hand._source = cards, None
+            else:
+                hand._cards, hand._source = None, cards
+            hand._strength = evaluator.evaluate(card_ids)
+            hand._name = None
+            return hand
         current_hand = Hand()
         for cards_subset in itertools.combinations(cards, min(5, len(cards))):
             candidate_hand = Hand(cards_subset)
@@ -347,6 +576,11 @@ class Player:
         cards_str = "[" + " ".join(str(c) for c in self.cards) + "]"
         return "{}: {}".format(self.name, cards_str)
 
+    @property
+    def card_set(self):
+        """Returns the private cards of the player as a CardSet."""
+        return CardSet(self.cards)
+
     def reset(self):
         self.cards = []
 
@@ -363,6 +597,11 @@ class Board:
         cards_str = "[" + " ".join(str(c) for c in self.cards) + "]"
         return "Board: " + cards_str
 
+    @property
+    def card_set(self):
+        """Returns the cards laid face up on the board as a CardSet."""
+        return CardSet(self.cards)
+
     def reset(self, shuffle_deck=False):
         """
         Resets the board: removes all the common cards and resets the deck to its original state.
@@ -494,7 +733,7 @@ class Game:
         """
         if isinstance(player, str):
             player = self.get_player_named(player)
-        total_cards = player.cards + self.board.cards
+        total_cards = list(player.cards) + list(self.board.cards)  # the cards can also be stored in CardSets
         return Hand.best_from_cards(total_cards)
 
     def players_with_hand(self):
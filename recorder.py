@@ -0,0 +1,188 @@
+"""Recording of the outcome of every deal of a simulation to compact binary files, and out-of-core analysis of them.
+
+Each deal is stored as a fixed size record of 18 bytes (instead of about 30 bytes per value in a Python list):
+- hero: unsigned 16-bit integer. Identifier of the hero or of the scenario (eg. index of the hand class).
+- winners: unsigned 32-bit integer. Bit mask of the winning players (bit 0 is the hero).
+- categories: unsigned 64-bit integer. Category of the hand of each player (see evaluator.CATEGORY_NAMES), 4 bits
+  per player, the hero in the lowest bits.
+- earning: 32-bit float. Earning of the hero.
+The records are appended to chunk files "chunk_000000.bin", "chunk_000001.bin", ... of a directory. The files are
+plain little-endian arrays of records, readable with numpy.memmap(path, dtype=RECORD_DTYPE) if numpy is available.
+Example usage :
+with Recorder("records/") as recorder:
+    simulation.simulate_earnings(hero_ids, 8, 100000, recorder=recorder)
+reader = RecordReader("records/")
+print(len(reader), reader.earnings_series(), reader.category_counts(player=0))
+"""
+import os
+import mmap
+import struct
+import collections
+
+from tools import RunningSeries
+
+RECORD = struct.Struct("<HIQf")
+RECORD_DTYPE = [("hero", "<u2"), ("winners", "<u4"), ("categories", "<u8"), ("earning", "<f4")]
+MAX_PLAYERS = 16  # 4 bits of the categories field per player
+CHUNK_NAME = "chunk_{:06d}.bin"
+
+Record = collections.namedtuple("Record", ["hero", "winners", "categories", "earning"])
+
+
+def pack_categories(categories):
+    """Packs a sequence of hand categories (one per player, the hero first) into an integer, 4 bits per player."""
+    packed = 0
+    for i, c in enumerate(categories):
+        packed |= c << (4 * i)
+    return packed
+
+
+def unpack_categories(packed, n_players):
+    """Inverse of pack_categories()."""
+    return [packed >> (4 * i) & 0xF for i in range(n_players)]
+
+
+class Recorder:
+    """Appends deal records to the chunk files of a directory. The records are buffered in memory and written by
+    blocks, a new chunk file is started every chunk_size records. Recording to an existing directory appends to it."""
+    def __init__(self, directory, chunk_size=1 << 20, buffer_size=1 << 12):
+        """
+        :param directory: string.
+        The directory is created if it does not exist.
+        :param chunk_size: integer.
+        Maximal number of records per chunk file.
+        :param buffer_size: integer.
+        Number of records buffered in memory before being written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self._buffer = bytearray()
+        self._n_buffered = 0
+        chunks = _chunk_paths(directory)
+        self._chunk_index = len(chunks) - 1 if chunks else 0
+        last_path = os.path.join(directory, CHUNK_NAME.format(self._chunk_index))
+        self._n_in_chunk = os.path.getsize(last_path) // RECORD.size if os.path.exists(last_path) else 0
+        if os.path.exists(last_path):  # drops a partially written last record (eg. an interrupted run)
+            os.truncate(last_path, self._n_in_chunk * RECORD.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, hero, winners, categories, earning):
+        """
+        Adds a record.
+        :param hero: integer in [0, 65536).
+        :param winners: integer. Bit mask of the winning players.
+        :param categories: integer. Categories packed with pack_categories().
+        :param earning: float.
+        :return: None.
+        """
+        self._buffer += RECORD.pack(hero, winners, categories, earning)
+        self._n_buffered += 1
+        if self._n_buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records to the chunk files."""
+        view = memoryview(self._buffer)
+        while self._n_buffered:
+            if self._n_in_chunk >= self.chunk_size:
+                self._chunk_index += 1
+                self._n_in_chunk = 0
+            n_records = min(self._n_buffered, self.chunk_size - self._n_in_chunk)
+            with open(os.path.join(self.directory, CHUNK_NAME.format(self._chunk_index)), "ab") as f:
+                f.write(view[:n_records * RECORD.size])
+            view = view[n_records * RECORD.size:]
+            self._n_in_chunk += n_records
+            self._n_buffered -= n_records
+        view.release()
+        self._buffer = bytearray()
+
+    def close(self):
+        self.flush()
+
+
+def _chunk_paths(directory):
+    """Returns the sorted list of the paths of the chunk files of a directory."""
+    names = sorted(name for name in os.listdir(directory) if name.startswith("chunk_") and name.endswith(".bin"))
+    return [os.path.join(directory, name) for name in names]
+
+
+class RecordReader:
+    """Reads the records written by a Recorder. The chunk files are memory-mapped one at a time, so the records never
+    need to fit in memory."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __len__(self):
+        return sum(os.path.getsize(path) // RECORD.size for path in _chunk_paths(self.directory))
+
+    def iter_chunks(self):
+        """Yields a read-only memoryview of the bytes of each chunk file."""
+        for path in _chunk_paths(self.directory):
+            n_bytes = os.path.getsize(path) // RECORD.size * RECORD.size  # ignores a partially written last record
+            if n_bytes == 0:
+                continue
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            yield memoryview(mapped)[:n_bytes]  # the file is unmapped once the view is garbage collected
+
+    def __iter__(self):
+        """Yields every record as a Record named tuple."""
+        for view in self.iter_chunks():
+            for fields in RECORD.iter_unpack(view):
+                yield Record(*fields)
+
+    def earnings_series(self, hero=None):
+        """
+        Returns the RunningSeries of the earnings.
+        :param hero: integer or None.
+        If not None, only the records of this hero are taken into account.
+        :return: RunningSeries.
+        """
+        series = RunningSeries()
+        for view in self.iter_chunks():
+            for record_hero, winners, categories, earning in RECORD.iter_unpack(view):
+                if hero is None or record_hero == hero:
+                    series.add(earning)
+        return series
+
+    def category_counts(self, player=0, hero=None):
+        """
+        Returns a dictionary where the keys are the hand categories of the designated player and the values are the
+        number of deals where the player had this category.
+        :param player: integer. Index of the player (0 is the hero).
+        :param hero: integer or None. If not None, only the records of this hero are taken into account.
+        :return: dictionary.
+        """
+        counts = collections.Counter()
+        shift = 4 * player
+        for view in self.iter_chunks():
+            for record_hero, winners, categories, earning in RECORD.iter_unpack(view):
+                if hero is None or record_hero == hero:
+                    counts[categories >> shift & 0xF] += 1
+        return dict(counts)
+
+    def win_counts(self, hero=None):
+        """
+        Returns a dictionary {"Win": n, "Lose": n, "Tie": n} counting the outcomes for the hero (as in Q4.py).
+        :param hero: integer or None. If not None, only the records of this hero are taken into account.
+        :return: dictionary.
+        """
+        counts = {"Win": 0, "Lose": 0, "Tie": 0}
+        for view in self.iter_chunks():
+            for record_hero, winners, categories, earning in RECORD.iter_unpack(view):
+                if hero is not None and record_hero != hero:
+                    continue
+                if not winners & 1:
+                    counts["Lose"] += 1
+                elif winners == 1:
+                    counts["Win"] += 1
+                else:
+                    counts["Tie"] += 1
+        return counts
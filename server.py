@@ -0,0 +1,269 @@
+"""A local equity query server. It keeps the evaluator tables and a pool of worker processes warm, so a query costs a
+simulation and not a new process.
+
+Protocol: the server listens on a unix socket (or on a localhost TCP port). Each request is a JSON object on one line,
+the response is a JSON object on one line. A client can send several requests on the same connection.
+Request: {"hero": "AsKs", "players": 3, "board": "Qs7h2s", "dead": "", "stories": 20000}
+Response: {"equity": 0.47, "ci_low": 0.46, "ci_high": 0.48, "n": 20000, "cached": false}
+The equity is the expected share of the pot of the hero: (average earning + 1) / players.
+
+The queries received during a short batch window are simulated together: identical queries share a single simulation
+and the distinct queries are sent to the workers in a few batches. The queries are identified by their canonical
+scenario (see store.canonical_scenario()) and the results are kept in an LRU cache. With a persistent store, the results
+are also merged into the store, and a query is only simulated for the deals missing in the store.
+Example usage :
+python server.py --socket /tmp/equity.sock --workers 8 --store results.sqlite
+print(query_server({"hero": "AsKs", "players": 3}, socket_path="/tmp/equity.sock"))
+"""
+import sys
+import json
+import signal
+import socket
+import asyncio
+import argparse
+import collections
+import concurrent.futures
+
+import evaluator
+import simulation
+from store import ResultStore, canonical_scenario
+from tools import RunningSeries
+
+
+def scenario_key(request, default_stories):
+    """
+    Returns the key of a request: (canonical scenario, stories). Raises a ValueError if the request is invalid.
+    :param request: dictionary.
+    :param default_stories: integer.
+    :return: tuple.
+    """
+    if not isinstance(request, dict):
+        raise ValueError("Invalid request {}: not a JSON object".format(request))
+    for field in ("hero", "board", "dead"):
+        if not isinstance(request.get(field, ""), str):
+            raise ValueError("Invalid request {}: '{}' must be a string of cards".format(request, field))
+    for field in ("players", "stories"):
+        if field in request and (not isinstance(request[field], int) or isinstance(request[field], bool)):
+            raise ValueError("Invalid request {}: '{}' must be an integer".format(request, field))
+    try:
+        hero = tuple(sorted(simulation.card_ids_from_string(request["hero"])))
+        board = tuple(sorted(simulation.card_ids_from_string(request.get("board", ""))))
+        dead = tuple(sorted(simulation.card_ids_from_string(request.get("dead", ""))))
+        players = request.get("players", 2)
+        stories = request.get("stories", default_stories)
+    except (KeyError, IndexError) as e:
+        raise ValueError("Invalid request {}: {!r}".format(request, e))
+    cards = hero + board + dead
+    if len(hero) != 2 or len(board) > 5 or len(set(cards)) != len(cards):
+        raise ValueError("Invalid cards in request {}".format(request))
+    if not 2 <= players or len(cards) + 2 * (players - 1) + 5 - len(board) > evaluator.N_CARDS or stories <= 0:
+        raise ValueError("Invalid number of players or of stories in request {}".format(request))
+    return canonical_scenario(hero, players, board, dead), stories
+
+
+def simulate_batch(units, seed):
+    """
+    Simulates a batch of scenarios in a worker. Returns the list of the states of the RunningSeries of the earnings.
+    :param units: list of (scenario, number of deals to simulate, index of the first deal). The index of the first deal
+    is part of the key of the random generator (see ResultStore.reserve()).
+    :param seed: integer or None.
+    :return: list of lists.
+    """
+    states = []
+    for scenario, n_stories, first_index in units:
+        hero, players, board, dead = scenario
+        states.append(simulation.earnings_unit(hero, players, n_stories, seed, (scenario, first_index), board, dead))
+    return states
+
+
+def equity_response(key, state, cached):
+    """Builds the response to a query from the state of the RunningSeries of the earnings."""
+    series = RunningSeries.from_state(state)
+    n_players = key[0][1]
+    low, high = series.confidence_range
+    return {"equity": (series.mean + 1) / n_players, "ci_low": (low + 1) / n_players,
+            "ci_high": (high + 1) / n_players, "n": series.n, "cached": cached}
+
+
+class EquityServer:
+    """Answers equity queries with micro-batched simulations run on a pool of worker processes."""
+    def __init__(self, workers=4, default_stories=20000, batch_window=0.005, cache_size=100000, seed=None,
+                 store_path=None):
+        """
+        :param workers: integer. Number of worker processes.
+        :param default_stories: integer. Number of deals of a query which does not specify it.
+        :param batch_window: float. Time in seconds during which the queries are gathered into a batch.
+        :param cache_size: integer. Maximal number of results kept in the cache.
+        :param seed: integer or None. If not None, the result of a query only depends on the seed and on the query.
+        :param store_path: string or None. Path of the ResultStore database used to persist the results.
+        """
+        self.workers = workers
+        self.default_stories = default_stories
+        self.batch_window = batch_window
+        self.cache_size = cache_size
+        self.seed = seed
+        self._cache = collections.OrderedDict()  # key -> state of the RunningSeries. LRU order.
+        self._in_flight = {}  # key -> asyncio.Future of the state, for the queries being simulated
+        self._batch = []  # keys waiting for the next batch
+        self._store = None
+        self._store_executor = None
+        if store_path is not None:
+            # the store is only used by a dedicated thread, so that its SQLite calls (which may wait for the lock of
+            # another process writing to the database) never block the event loop
+            self._store_executor = concurrent.futures.ThreadPoolExecutor(1)
+            self._store = self._store_executor.submit(ResultStore, store_path).result()
+        self._shared_tables = evaluator.SharedTables()
+        self._executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=evaluator.attach_shared_tables,
+                                                                initargs=(self._shared_tables.handle,))
+
+    def close(self):
+        self._executor.shutdown()
+        self._shared_tables.close()
+        if self._store is not None:
+            self._store_executor.submit(self._store.close).result()
+            self._store_executor.shutdown()
+
+    async def _in_store_thread(self, function, *args):
+        """Runs a function using the store in the store thread and returns its result."""
+        return await asyncio.get_running_loop().run_in_executor(self._store_executor, function, *args)
+
+    def _reserve_units(self, groups):
+        """Store thread: returns the units topping up in the store the scenarios of groups of keys, up to the largest
+        number of deals of each group."""
+        units = []
+        for group in groups:
+            scenario = group[0][0]
+            n_missing = max(0, max(n_stories for s, n_stories in group) - self._store.get(scenario).n)
+            units.append((scenario, n_missing, self._store.reserve(scenario, n_missing)))
+        return units
+
+    def _add_results(self, units, states):
+        """Store thread: merges the results of the units into the store and returns the stored states."""
+        return [self._store.add(unit[0], RunningSeries.from_state(state)).state for unit, state in zip(units, states)]
+
+    async def query(self, request):
+        """
+        Returns the response to a query.
+        :param request: dictionary. See the module documentation.
+        :return: dictionary.
+        """
+        key = scenario_key(request, self.default_stories)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return equity_response(key, self._cache[key], cached=True)
+        if self._store is not None and key not in self._in_flight:
+            stored = await self._in_store_thread(self._store.get, key[0])
+            if stored.n >= key[1]:
+                self._cache[key] = stored.state
+                return equity_response(key, stored.state, cached=True)
+        if key not in self._in_flight:
+            self._in_flight[key] = asyncio.get_running_loop().create_future()
+            if not self._batch:
+                asyncio.get_running_loop().call_later(self.batch_window, self._start_batch)
+            self._batch.append(key)
+        state = await asyncio.shield(self._in_flight[key])
+        return equity_response(key, state, cached=False)
+
+    def _start_batch(self):
+        """Sends the gathered keys to the workers, split in at most one batch per worker. The keys of the same scenario
+        (with different numbers of deals) are grouped: the scenario is simulated once, up to the largest number."""
+        keys, self._batch = self._batch, []
+        groups = {}
+        for key in keys:
+            groups.setdefault(key[0], []).append(key)
+        groups = list(groups.values())
+        n_batches = min(self.workers, len(groups))
+        for i in range(n_batches):
+            asyncio.ensure_future(self._run_batch(groups[i::n_batches]))
+
+    async def _run_batch(self, groups):
+        loop = asyncio.get_running_loop()
+        try:  # every failure is sent to the waiting queries, so that no client waits forever
+            if self._store is not None:
+                units = await self._in_store_thread(self._reserve_units, groups)
+            else:
+                units = [(group[0][0], max(n_stories for s, n_stories in group), 0) for group in groups]
+            states = await loop.run_in_executor(self._executor, simulate_batch, units, self.seed)
+            if self._store is not None:
+                states = await self._in_store_thread(self._add_results, units, states)
+        except Exception as e:
+            for group in groups:
+                for key in group:
+                    self._in_flight.pop(key).set_exception(e)
+            return
+        for group, state in zip(groups, states):
+            for key in group:
+                self._cache[key] = state
+                self._in_flight.pop(key).set_result(state)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def handle_client(self, reader, writer):
+        """Answers the requests of a connection, one JSON object per line."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.query(json.loads(line))
+                except ValueError as e:  # invalid request
+                    response = {"error": str(e)}
+                except Exception as e:  # failed simulation or store: the connection stays open
+                    response = {"error": "{}: {}".format(type(e).__name__, e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, host="127.0.0.1", port=8765):
+        """Serves forever on the unix socket socket_path or, if it is None, on the TCP address host:port."""
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, path=socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+
+def query_server(request, socket_path=None, host="127.0.0.1", port=8765):
+    """
+    Sends a single query to a running server and returns its response. Raises a ValueError if the server returns an
+    error.
+    :param request: dictionary.
+    :return: dictionary.
+    """
+    if socket_path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, connection.makefile("rwb") as f:
+        f.write(json.dumps(request).encode() + b"\n")
+        f.flush()
+        response = json.loads(f.readline())
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local equity query server.")
+    parser.add_argument("--socket", default=None, help="path of the unix socket. Default: TCP on --host:--port")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--stories", type=int, default=20000, help="default number of deals per query")
+    parser.add_argument("--batch-window", type=float, default=0.005, help="batch window in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--store", default=None, help="path of the persistent result store (SQLite)")
+    args = parser.parse_args()
+    equity_server = EquityServer(args.workers, args.stories, args.batch_window, seed=args.seed,
+                                 store_path=args.store)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # so that the shared memory is freed
+    try:
+        asyncio.run(equity_server.serve(args.socket, args.host, args.port))
+    finally:
+        equity_server.close()
@@ -0,0 +1,249 @@
+"""A sharded runner for sweeps too big for one machine, coordinated through a shared directory (eg. on NFS).
+
+The sweep (hand classes x numbers of players, n_stories deals each) is split into deterministic work units: a hand
+class, a number of players, a range of deals and the key of its random generator (see simulation.unit_rng()), so the
+result of a unit does not depend on the worker which runs it. The directory holds:
+- plan.json: the config of the sweep,
+- todo/: one file per unit waiting for a worker,
+- claimed/: the units being simulated. A worker claims a unit by renaming its file from todo/ to claimed/, which is
+  atomic, so a unit is only claimed by one worker even with workers on several hosts,
+- done/: the partial result of every finished unit (the state of the RunningSeries of the earnings), written
+  atomically.
+The reducer merges the partial results into the ranking printed by the Q5 scripts, once every unit is done (or with
+"reduce --partial" to follow the progress). If a worker dies, its claimed units can be put back in todo/ with
+requeue_stale_units().
+Example usage (the commands can be run on any number of hosts sharing the directory):
+python shards.py plan /shared/q5 --players 8 9 10 --stories 160000 --seed 0
+python shards.py work /shared/q5 --processes 8
+python shards.py status /shared/q5
+python shards.py reduce /shared/q5
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import multiprocessing
+
+import simulation
+from sweep import write_json_atomically, ranking
+from tools import RunningSeries
+
+TODO, CLAIMED, DONE = "todo", "claimed", "done"
+
+
+def _unit_name(unit):
+    return "{}_{}p_{:06d}.json".format(unit["hand_class"], unit["n_players"], unit["index"])
+
+
+def plan_units(hand_classes, player_counts, n_stories, seed, unit_size=simulation.UNIT_SIZE):
+    """
+    Returns the deterministic work units of a sweep.
+    :param hand_classes: iterable of strings (eg. ["AA", "AKs"]).
+    :param player_counts: iterable of integers.
+    :param n_stories: integer. Number of deals per hand class and number of players.
+    :param seed: integer.
+    :param unit_size: integer. Number of deals per unit.
+    :return: list of dictionaries.
+    """
+    units = []
+    for n_players in player_counts:
+        for hand_class in hand_classes:
+            first_story = 0
+            for index, n in enumerate(simulation.split_stories(n_stories, unit_size)):
+                units.append({"hand_class": hand_class, "n_players": n_players, "index": index,
+                              "first_story": first_story, "n_stories": n, "seed": seed})
+                first_story += n
+    return units
+
+
+def create_plan(directory, hand_classes, player_counts, n_stories, seed=None, unit_size=simulation.UNIT_SIZE):
+    """
+    Creates the shared directory of a sweep and writes its units to todo/. Does nothing if the directory already holds
+    the same sweep, and raises a ValueError if it holds a different one.
+    :param directory: string.
+    :param seed: integer or None. If None, a seed is drawn and stored in the plan so that the units stay deterministic.
+    :return: dictionary. The config of the sweep.
+    """
+    plan_path = os.path.join(directory, "plan.json")
+    config = {"hand_classes": list(hand_classes), "player_counts": list(player_counts), "n_stories": n_stories,
+              "unit_size": unit_size}
+    if os.path.exists(plan_path):
+        with open(plan_path) as f:
+            existing = json.load(f)
+        if {key: value for key, value in existing.items() if key != "seed"} != config or \
+                (seed is not None and existing["seed"] != seed):
+            raise ValueError("{} already holds a different sweep: {}".format(directory, existing))
+        return existing
+    config["seed"] = seed if seed is not None else random.randrange(2 ** 32)
+    for sub_directory in (TODO, CLAIMED, DONE):
+        os.makedirs(os.path.join(directory, sub_directory), exist_ok=True)
+    for unit in plan_units(config["hand_classes"], config["player_counts"], n_stories, config["seed"], unit_size):
+        write_json_atomically(unit, os.path.join(directory, TODO, _unit_name(unit)))
+    write_json_atomically(config, plan_path)  # written last: a directory with a plan has all its units
+    return config
+
+
+def claim_unit(directory, worker_id):
+    """
+    Claims a unit of todo/ by renaming it to claimed/. Returns (unit, path of the claimed file) or None if there is no
+    unit left. The units are tried from a random position so that concurrent workers rarely compete for the same one.
+    """
+    todo_directory = os.path.join(directory, TODO)
+    names = sorted(name for name in os.listdir(todo_directory) if name.endswith(".json"))
+    start = random.randrange(len(names)) if names else 0
+    for name in names[start:] + names[:start]:
+        todo_path = os.path.join(todo_directory, name)
+        claimed_path = os.path.join(directory, CLAIMED, "{}@{}".format(name, worker_id))
+        try:
+            # the modification time is the claim time (see requeue_stale_units()). It is set before the rename, so
+            # that a claimed file never has the time of the plan
+            os.utime(todo_path)
+            os.rename(todo_path, claimed_path)
+        except FileNotFoundError:  # claimed by another worker in the meantime
+            continue
+        with open(claimed_path) as f:
+            return json.load(f), claimed_path
+    return None
+
+
+def run_unit(unit):
+    """Simulates a unit. Returns the state of the RunningSeries of the earnings."""
+    key = (unit["hand_class"], unit["n_players"], unit["index"])
+    return simulation.earnings_unit(simulation.hand_class_cards(unit["hand_class"]), unit["n_players"],
+                                    unit["n_stories"], unit["seed"], key)
+
+
+def run_worker(directory, worker_id=None, max_units=None, verbose=False):
+    """
+    Claims and simulates units until there is none left (or until max_units units are done).
+    :param directory: string.
+    :param worker_id: string or None. Default: host name and process id.
+    :param max_units: integer or None.
+    :param verbose: boolean. If True, prints every finished unit.
+    :return: integer. Number of units done by this worker.
+    """
+    if worker_id is None:
+        worker_id = "{}-{}".format(socket.gethostname(), os.getpid())
+    n_done = 0
+    while max_units is None or n_done < max_units:
+        claimed = claim_unit(directory, worker_id)
+        if claimed is None:
+            break
+        unit, claimed_path = claimed
+        result = dict(unit, state=run_unit(unit), worker=worker_id)
+        write_json_atomically(result, os.path.join(directory, DONE, _unit_name(unit)))
+        try:
+            os.remove(claimed_path)
+        except FileNotFoundError:  # requeued in the meantime (see requeue_stale_units())
+            pass
+        n_done += 1
+        if verbose:
+            print("{} done by {}".format(_unit_name(unit), worker_id))
+    return n_done
+
+
+def requeue_stale_units(directory, timeout):
+    """
+    Puts back in todo/ the units claimed more than timeout seconds ago (eg. by a worker which died). If the worker was
+    only slow, the unit is simulated twice with the same random generator and the second result replaces the first
+    one, so the results are not counted twice.
+    :return: integer. Number of units put back.
+    """
+    n_requeued = 0
+    claimed_directory = os.path.join(directory, CLAIMED)
+    for claimed_name in os.listdir(claimed_directory):
+        claimed_path = os.path.join(claimed_directory, claimed_name)
+        try:
+            if time.time() - os.path.getmtime(claimed_path) > timeout:
+                os.rename(claimed_path, os.path.join(directory, TODO, claimed_name.split("@")[0]))
+                n_requeued += 1
+        except FileNotFoundError:  # finished in the meantime
+            continue
+    return n_requeued
+
+
+def status(directory):
+    """Returns the number of units of each state: {"todo": ..., "claimed": ..., "done": ...}."""
+    return {state: sum(1 for name in os.listdir(os.path.join(directory, state)) if ".json" in name)
+            for state in (TODO, CLAIMED, DONE)}
+
+
+def reduce_results(directory, allow_incomplete=False):
+    """
+    Merges the partial results of the finished units. Raises a ValueError if units are still waiting or being
+    simulated, unless allow_incomplete is True.
+    :param directory: string.
+    :param allow_incomplete: boolean. If True, the results of an unfinished sweep are merged anyway (eg. to follow
+    its progress), and their ranking only covers the finished units.
+    :return: dictionary n_players -> dictionary hand class -> RunningSeries.
+    """
+    counts = status(directory)
+    if not allow_incomplete and (counts[TODO] or counts[CLAIMED]):
+        raise ValueError("The sweep of {} is not finished: {}".format(directory, counts))
+    with open(os.path.join(directory, "plan.json")) as f:
+        config = json.load(f)
+    results = {n_players: {hand_class: RunningSeries() for hand_class in config["hand_classes"]}
+               for n_players in config["player_counts"]}
+    done_directory = os.path.join(directory, DONE)
+    for name in os.listdir(done_directory):
+        if not name.endswith(".json"):  # temporary files being written
+            continue
+        with open(os.path.join(done_directory, name)) as f:
+            result = json.load(f)
+        results[result["n_players"]][result["hand_class"]].merge(RunningSeries.from_state(result["state"]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweeps sharded through a shared directory.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    plan_parser = subparsers.add_parser("plan", help="creates the units of a sweep")
+    plan_parser.add_argument("directory")
+    plan_parser.add_argument("--hands", nargs="+", default=None, help="hand classes. Default: the 169 hand classes")
+    plan_parser.add_argument("--players", type=int, nargs="+", default=[8], help="numbers of players")
+    plan_parser.add_argument("--stories", type=int, default=160000, help="number of deals per hand class")
+    plan_parser.add_argument("--seed", type=int, default=None)
+    plan_parser.add_argument("--unit-size", type=int, default=simulation.UNIT_SIZE, help="number of deals per unit")
+    work_parser = subparsers.add_parser("work", help="simulates units until there is none left")
+    work_parser.add_argument("directory")
+    work_parser.add_argument("--processes", type=int, default=1, help="number of worker processes on this host")
+    requeue_parser = subparsers.add_parser("requeue", help="puts back the units claimed for too long")
+    requeue_parser.add_argument("directory")
+    requeue_parser.add_argument("--timeout", type=float, default=3600., help="in seconds")
+    status_parser = subparsers.add_parser("status", help="prints the number of units of each state")
+    status_parser.add_argument("directory")
+    reduce_parser = subparsers.add_parser("reduce", help="prints the rankings of the finished units")
+    reduce_parser.add_argument("directory")
+    reduce_parser.add_argument("--partial", action="store_true",
+                               help="prints the rankings of the finished units of an unfinished sweep")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        print(create_plan(args.directory, args.hands or simulation.all_hand_classes(), args.players, args.stories,
+                          args.seed, args.unit_size))
+    elif args.command == "work":
+        processes = [multiprocessing.Process(target=run_worker, args=(args.directory,), kwargs={"verbose": True})
+                     for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.command == "requeue":
+        print(requeue_stale_units(args.directory, args.timeout))
+    elif args.command == "status":
+        print(status(args.directory))
+    else:
+        if args.partial:
+            print("Units: {}".format(status(args.directory)))
+        try:
+            results = reduce_results(args.directory, allow_incomplete=args.partial)
+        except ValueError as e:  # eg. an unfinished sweep: the message gives the number of units of each state
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        for n_players, player_results in results.items():
+            print("{} players:".format(n_players))
+            for hand_stats in ranking(player_results):
+                print(hand_stats)
@@ -0,0 +1,428 @@
+"""The simulation engine: plays Texas Hold'em deals on integer card ids with the table evaluator. It computes the same
+quantities as the Q4/Q5/QCM scripts (which play the deals with Game objects) but much faster. The deals are played by
+the stages of pipeline.py.
+
+A hand class is the usual description of two private cards regardless of their suits: "AA", "AKs" (suited),
+"AKo" (offsuit). There are 169 hand classes.
+Example usage :
+hero_ids = hand_class_cards("AKs")
+series = simulate_earnings(hero_ids, n_players=8, n_stories=10000, rng=random.Random(0))
+print(series.mean, series.confidence_range)
+"""
+import random
+import itertools
+import collections
+import multiprocessing
+import concurrent.futures
+
+import poker
+import evaluator
+import pipeline
+import recorder as recorder_module
+from tools import RunningSeries
+
+RANK_CHARS = "23456789TJQKA"  # short ranks ordered by value
+SUIT_CHARS = "cdhs"  # short suits ordered as in evaluator card ids
+UNIT_SIZE = 10000  # default number of deals of a work unit
+BACKENDS = ["serial", "process", "thread"]
+remaining_card_ids = evaluator.remaining_card_ids  # the deals of every simulation are drawn from these cards
+
+
+def card_ids_from_string(cards_string):
+    """
+    Returns the ids of the cards described by a string of short descriptions (eg. "As" or "9s8s" or "Qh Jh 2c").
+    Raises a KeyError if a description is not valid.
+    :param cards_string: string.
+    :return: list of integers.
+    """
+    cards_string = cards_string.replace(" ", "")
+    return [poker.CARD_IDS[tuple(cards_string[i:i + 2])] for i in range(0, len(cards_string), 2)]
+
+
+def parse_cards(cards_strings):
+    """
+    Bulk version of card_ids_from_string(): returns the ids of the cards of every string (eg. hands or boards).
+    :param cards_strings: iterable of strings (eg. ["AsKs", "9d9c", "Qs7h2s"]).
+    :return: list of lists of integers.
+    """
+    return [card_ids_from_string(cards_string) for cards_string in cards_strings]
+
+
+def _class_ranks(hand_class, token):
+    """Returns (index of the first rank, index of the second rank, suffix) of a hand class of a range token (eg. "AKs",
+    "QQ", "AK"). Raises a ValueError naming the token if the class is not valid."""
+    if len(hand_class) not in (2, 3) or hand_class[0] not in RANK_CHARS or hand_class[1] not in RANK_CHARS or \
+            hand_class[2:] not in ("", "s", "o") or (hand_class[0] == hand_class[1] and hand_class[2:]) or \
+            RANK_CHARS.index(hand_class[0]) < RANK_CHARS.index(hand_class[1]):
+        raise ValueError("Invalid range token '{}'.".format(token))
+    return RANK_CHARS.index(hand_class[0]), RANK_CHARS.index(hand_class[1]), hand_class[2:]
+
+
+def _range_classes(token):
+    """Returns the hand classes of a range token without explicit cards (eg. "QQ+", "ATs+", "A5s-A2s", "AK"). A class
+    without suffix stands for both the suited and the offsuit hands (eg. "AT+" is ATs, ATo, AJs, AJo, ...)."""
+    if "-" in token:
+        first, last = token.split("-", 1)
+        high_1, high_2, suffix = _class_ranks(first, token)
+        low_1, low_2, low_suffix = _class_ranks(last, token)
+        if high_1 == high_2 and low_1 == low_2 and low_1 <= high_1:  # pairs (eg. "QQ-99")
+            return [RANK_CHARS[r] * 2 for r in range(low_1, high_1 + 1)]
+        if high_1 == high_2 or low_1 == low_2 or high_1 != low_1 or suffix != low_suffix or low_2 > high_2:
+            raise ValueError("Invalid range token '{}'.".format(token))
+        rank_pairs = [(high_1, k) for k in range(low_2, high_2 + 1)]  # eg. "A5s-A2s"
+    elif token.endswith("+"):
+        first, second, suffix = _class_ranks(token[:-1], token)
+        if first == second:  # pairs (eg. "QQ+" is QQ, KK and AA)
+            return [RANK_CHARS[r] * 2 for r in range(first, len(RANK_CHARS))]
+        rank_pairs = [(first, k) for k in range(second, first)]  # eg. "ATs+" is ATs, AJs, AQs and AKs
+    else:
+        first, second, suffix = _class_ranks(token, token)
+        if first == second:
+            return [token]
+        rank_pairs = [(first, second)]
+    suffixes = [suffix] if suffix else ["s", "o"]
+    return [RANK_CHARS[high] + RANK_CHARS[low] + s for high, low in rank_pairs for s in suffixes]
+
+
+def parse_range(range_string):
+    """
+    Returns the pairs of cards of a range of hands, without duplicates.
+    :param range_string: string. Comma separated tokens: explicit cards (eg. "AsKs"), hand classes (eg. "AKs", "QQ",
+    "AK" for both "AKs" and "AKo"), classes and the better ones (eg. "QQ+", "ATs+") and intervals (eg. "99-66",
+    "A5s-A2s"). Raises a ValueError naming the first invalid token.
+    :return: list of (integer, integer).
+    """
+    combos = []
+    seen = set()
+    for token in range_string.replace(" ", "").split(","):
+        if not token:
+            continue
+        if len(token) == 4 and tuple(token[:2]) in poker.CARD_IDS and tuple(token[2:]) in poker.CARD_IDS:
+            token_combos = [(poker.CARD_IDS[tuple(token[:2])], poker.CARD_IDS[tuple(token[2:])])]
+            if token_combos[0][0] == token_combos[0][1]:  # eg. "AsAs"
+                raise ValueError("Invalid range token '{}'.".format(token))
+        else:
+            token_combos = [combo for hand_class in _range_classes(token) for combo in hand_class_combos(hand_class)]
+        for combo in token_combos:
+            if frozenset(combo) not in seen:
+                seen.add(frozenset(combo))
+                combos.append(combo)
+    return combos
+
+
+def load_scenarios(path):
+    """
+    Reads a file of scenarios, one per line in the format of store.scenario_to_string(): hero cards, number of players,
+    board cards and dead cards separated by "/" (eg. "AsKs/3/Qs7h2s/"). Empty lines and lines starting with "#" are
+    ignored.
+    :param path: string.
+    :return: list of (list of card ids, integer, list of card ids, list of card ids).
+    """
+    with open(path) as f:
+        fields = [line.strip().split("/") for line in f if line.strip() and not line.strip().startswith("#")]
+    hero, board, dead = (parse_cards(column) for column in ([row[0] for row in fields],
+                                                            [row[2] if len(row) > 2 else "" for row in fields],
+                                                            [row[3] if len(row) > 3 else "" for row in fields]))
+    return [(hero[i], int(row[1]), board[i], dead[i]) for i, row in enumerate(fields)]
+
+
+def card_ids_to_string(card_ids):
+    """Inverse of card_ids_from_string(): returns the short descriptions of the cards (eg. "AsKs")."""
+    return "".join(RANK_CHARS[c % evaluator.N_RANKS] + SUIT_CHARS[c // evaluator.N_RANKS] for c in card_ids)
+
+
+def deck_card_ids(deck_size=52):
+    """Returns the ids of the cards of the standard 32 or 52 card deck."""
+    lowest_rank = 0 if deck_size == 52 else RANK_CHARS.index("7")
+    return [c for c in range(evaluator.N_CARDS) if c % evaluator.N_RANKS >= lowest_rank]
+
+
+def hand_class_cards(hand_class):
+    """
+    Returns the ids of two cards representing a hand class. Pairs are dealt in spades and diamonds, suited hands in
+    spades and offsuit hands in spades and diamonds (as in the Q5 scripts).
+    :param hand_class: string (eg. "AA", "AKs", "72o").
+    :return: (integer, integer).
+    """
+    high, low = RANK_CHARS.index(hand_class[0]), RANK_CHARS.index(hand_class[1])
+    spades, diamonds = 3 * evaluator.N_RANKS, 1 * evaluator.N_RANKS
+    if hand_class[2:] == "s":
+        return spades + high, spades + low
+    return spades + high, diamonds + low
+
+
+def hand_class_combos(hand_class):
+    """
+    Returns every pair of cards of a hand class: 6 for a pair, 4 for a suited hand and 12 for an offsuit hand.
+    :param hand_class: string (eg. "AA", "AKs", "72o").
+    :return: list of (integer, integer).
+    """
+    high, low = RANK_CHARS.index(hand_class[0]), RANK_CHARS.index(hand_class[1])
+    n_ranks = evaluator.N_RANKS
+    combos = []
+    for suit_1, suit_2 in itertools.product(range(evaluator.N_SUITS), repeat=2):
+        if high == low and suit_1 >= suit_2:
+            continue
+        if high != low and (suit_1 == suit_2) != (hand_class[2:] == "s"):
+            continue
+        combos.append((suit_1 * n_ranks + high, suit_2 * n_ranks + low))
+    return combos
+
+
+def all_hand_classes():
+    """Returns the list of the 169 hand classes, from "AA" down to "32o"."""
+    classes = []
+    for i in reversed(range(len(RANK_CHARS))):
+        for j in reversed(range(i + 1)):
+            if i == j:
+                classes.append(RANK_CHARS[i] * 2)
+            else:
+                classes += [RANK_CHARS[i] + RANK_CHARS[j] + "s", RANK_CHARS[i] + RANK_CHARS[j] + "o"]
+    return classes
+
+
+def simulate_earnings(hero_ids, n_players, n_stories, rng=random, board_ids=(), dead_ids=(), series=None,
+                      recorder=None, hero_key=0):
+    """
+    Plays n_stories deals where the hero (player 1) always receives the same private cards while the other players
+    receive random cards, and returns the earnings of the hero. Each player bets 1 and the winners share the pot, so
+    the earning of a deal is n_players / n_winners - 1 if the hero wins and -1 otherwise.
+    :param hero_ids: sequence of 2 card ids.
+    :param n_players: integer.
+    Number of players including the hero.
+    :param n_stories: integer.
+    Number of deals.
+    :param rng: random.Random or the random module.
+    :param board_ids: sequence of card ids.
+    Cards already known on the board. The board is completed at random.
+    :param dead_ids: sequence of card ids.
+    Cards known not to be in the deck (burnt or folded cards).
+    :param series: RunningSeries or None.
+    If provided, the earnings are added to this series instead of a new one.
+    :param recorder: recorder.Recorder or None.
+    If provided, the outcome of every deal is recorded.
+    :param hero_key: integer.
+    Identifier of the hero written in the records.
+    :return: RunningSeries.
+    """
+    if recorder is not None and n_players > recorder_module.MAX_PLAYERS:
+        raise ValueError("At most {} players can be recorded.".format(recorder_module.MAX_PLAYERS))
+    strengths = pipeline.evaluate_deals(pipeline.deal([hero_ids], n_players, n_stories, rng, board_ids, dead_ids))
+    if recorder is not None:
+        strengths = pipeline.record_outcomes(strengths, recorder, hero_key)
+    return pipeline.reduce_earnings(pipeline.showdown(strengths), series=series)
+
+
+def simulate_outcomes(known_hands, n_players, n_stories, rng=random, board_ids=(), dead_ids=(), results=None):
+    """
+    Plays n_stories deals where the first players always receive the same private cards (the first one is the hero)
+    while the other players receive random cards, and counts the outcomes of the hero as in Q4.py and QCM_Q1.py.
+    :param known_hands: sequence of sequences of 2 card ids.
+    :param n_players: integer.
+    Number of players including the players with known hands.
+    :param n_stories: integer.
+    :param rng: random.Random or the random module.
+    :param board_ids: sequence of card ids.
+    :param dead_ids: sequence of card ids.
+    :param results: dictionary or None.
+    If provided, the outcomes are added to the series of this dictionary.
+    :return: dictionary.
+    The keys are "Win", "Lose" and "Tie" and the values are RunningSeries of the indicators of each outcome.
+    """
+    chunks = pipeline.deal(known_hands, n_players, n_stories, rng, board_ids, dead_ids)
+    return pipeline.reduce_outcomes(pipeline.evaluate_deals(chunks), results=results)
+
+
+def sample_categories(deck_ids, n_cards, n_stories, rng=random, counts=None):
+    """
+    Draws n_stories times n_cards cards at random from the deck and counts the names of the best hands, as in Q2.py.
+    :param deck_ids: sequence of card ids.
+    :param n_cards: integer.
+    :param n_stories: integer.
+    :param rng: random.Random or the random module.
+    :param counts: collections.Counter or None.
+    If provided, the names are counted in this counter.
+    :return: collections.Counter.
+    """
+    if counts is None:
+        counts = collections.Counter()
+    deck_ids = list(deck_ids)
+    evaluate = evaluator.get_tables(evaluator.deck_values(deck_ids)).evaluate  # eg. the small 32 card deck tables
+    strengths = collections.Counter(evaluate(rng.sample(deck_ids, n_cards)) for i in range(n_stories))
+    for strength, count in strengths.items():
+        counts[evaluator.hand_name(strength)] += count
+    return counts
+
+
+def count_categories(deck_ids, n_cards):
+    """
+    Counts the names of the best hands of every combination of n_cards cards of the deck, as in Q1.py. For a full deck
+    (every suit of an interval of ranks, eg. the 32 and 52 card decks), the combinations are counted by multisets of
+    ranks without being enumerated (see evaluator.exhaustive_counts()). Otherwise they are enumerated.
+    """
+    deck_ids = list(deck_ids)
+    values = evaluator.deck_values(deck_ids)
+    if sorted(deck_ids) == [s * evaluator.N_RANKS + v - 2 for s in range(evaluator.N_SUITS) for v in values]:
+        strengths = evaluator.exhaustive_counts(n_cards, values)
+    else:
+        evaluate = evaluator.get_tables(values).evaluate
+        strengths = collections.Counter(evaluate(cards) for cards in itertools.combinations(deck_ids, n_cards))
+    counts = collections.Counter()
+    for strength, count in strengths.items():
+        counts[evaluator.hand_name(strength)] += count
+    return counts
+
+
+def unit_rng(seed, *key):
+    """
+    Returns the random generator of a work unit. The generator only depends on the seed and on the key of the unit
+    (and not on the worker running it), so the results of a seeded run do not depend on the number of workers.
+    :param seed: integer, string or None. If None, the generator is seeded from the operating system.
+    :param key: strings or integers identifying the work unit.
+    :return: random.Random.
+    """
+    if seed is None:
+        return random.Random()
+    return random.Random("/".join(str(k) for k in (seed,) + key))
+
+
+def split_stories(n_stories, unit_size=UNIT_SIZE):
+    """Splits a number of deals into work units of at most unit_size deals."""
+    return [min(unit_size, n_stories - start) for start in range(0, n_stories, unit_size)]
+
+
+def earnings_unit(hero_ids, n_players, n_stories, seed, key, board_ids=(), dead_ids=()):
+    """Work unit of simulate_earnings(). Returns the state of the RunningSeries of the earnings."""
+    rng = unit_rng(seed, *key)
+    return simulate_earnings(hero_ids, n_players, n_stories, rng, board_ids, dead_ids).state
+
+
+def outcomes_unit(known_hands, n_players, n_stories, seed, key, board_ids=(), dead_ids=()):
+    """Work unit of simulate_outcomes(). Returns the states of the RunningSeries of the outcomes."""
+    rng = unit_rng(seed, *key)
+    results = simulate_outcomes(known_hands, n_players, n_stories, rng, board_ids, dead_ids)
+    return {name: series.state for name, series in results.items()}
+
+
+def categories_unit(deck_ids, n_cards, n_stories, seed, key):
+    """Work unit of sample_categories(). Returns the counts as a dictionary."""
+    return dict(sample_categories(deck_ids, n_cards, n_stories, unit_rng(seed, *key)))
+
+
+def pipeline_unit(known_hands, n_players, n_stories, seed, key, board_ids=(), dead_ids=(),
+                  stages=pipeline.EARNINGS_STAGES, chunk_size=pipeline.CHUNK_SIZE):
+    """Work unit of run_pipeline(). Returns the result of the reducer."""
+    chunks = pipeline.deal(known_hands, n_players, n_stories, unit_rng(seed, *key), board_ids, dead_ids, chunk_size)
+    return pipeline.run_stages(chunks, stages)
+
+
+def run_pipeline(known_hands, n_players, n_stories, stages=pipeline.EARNINGS_STAGES, engine=None, seed=None,
+                 board_ids=(), dead_ids=(), chunk_size=pipeline.CHUNK_SIZE, unit_size=UNIT_SIZE):
+    """
+    Runs custom pipeline stages on work units of unit_size deals and merges the results of their reducers.
+    :param known_hands: sequence of sequences of 2 card ids. See pipeline.deal().
+    :param n_players: integer.
+    :param n_stories: integer.
+    :param stages: sequence of functions defined at the top level of a module (so that they can be sent to the
+    workers). The last stage must return a RunningSeries, a collections.Counter or a dictionary of RunningSeries (eg.
+    pipeline.OUTCOMES_STAGES).
+    :param engine: Engine or None. If provided, the work units are run by the engine.
+    :param seed: integer or None.
+    :param board_ids: sequence of card ids.
+    :param dead_ids: sequence of card ids.
+    :param chunk_size: integer. Number of deals per chunk.
+    :param unit_size: integer. Number of deals per work unit.
+    :return: RunningSeries, collections.Counter or dictionary of RunningSeries.
+    """
+    if n_stories <= 0:
+        raise ValueError("The number of deals must be positive.")
+    known_hands = [list(hand) for hand in known_hands]
+    units = [(known_hands, n_players, n, seed, ("pipeline", i), list(board_ids), list(dead_ids), tuple(stages),
+              chunk_size) for i, n in enumerate(split_stories(n_stories, unit_size))]
+    results = engine.map(pipeline_unit, units) if engine is not None else [pipeline_unit(*unit) for unit in units]
+    return _merge_results(results)
+
+
+def _merge_results(results):
+    """Merges the results of the reducers of the work units of run_pipeline(). Raises a TypeError if the results cannot
+    be merged."""
+    total = results[0]
+    if isinstance(total, RunningSeries):
+        for result in results[1:]:
+            total.merge(result)
+    elif isinstance(total, collections.Counter):
+        for result in results[1:]:
+            total.update(result)
+    elif isinstance(total, dict) and all(isinstance(series, RunningSeries) for series in total.values()):
+        for result in results[1:]:
+            for name, series in result.items():
+                total.setdefault(name, RunningSeries()).merge(series)
+    else:
+        raise TypeError("Cannot merge the results of a reducer of type {}.".format(type(total).__name__))
+    return total
+
+
+class Engine:
+    """Runs work units in this process ("serial" backend), in a pool of worker processes ("process" backend) or in a
+    pool of threads ("thread" backend). The worker processes attach to the evaluator tables published once in shared
+    memory, but the arguments and the results of the units are pickled to and from the workers. The threads use the
+    tables and the arguments of this process directly, without pickling nor copying them. Every unit has its own random
+    generator (see unit_rng()) and returns its own partial result, which are merged by the caller, so the results do not
+    depend on the backend. The units are Python code holding the GIL, so the thread backend only runs them in parallel
+    on a free-threaded build of Python. The pool is started on first use and is reused until the engine is closed.
+    Example usage :
+    with Engine(workers=4) as engine:
+        states = engine.map(earnings_unit, [(hero_ids, 8, 10000, seed, ("AA", i)) for i in range(10)])
+    """
+    def __init__(self, workers=1, backend="process"):
+        """
+        :param workers: integer.
+        Number of workers. With 1 worker the units are run in this process whatever the backend.
+        :param backend: string. One of BACKENDS.
+        """
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend '{}'. Available backends: {}".format(backend, BACKENDS))
+        self.workers = workers
+        self.backend = backend
+        self._shared_tables = None
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_pool(self):
+        if self._pool is None and self.backend == "thread":
+            evaluator.get_tables()  # loaded once before the threads share it
+            self._pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        elif self._pool is None:
+            self._shared_tables = evaluator.SharedTables()
+            self._pool = multiprocessing.Pool(self.workers, initializer=evaluator.attach_shared_tables,
+                                              initargs=(self._shared_tables.handle,))
+        return self._pool
+
+    def map(self, function, args_list):
+        """
+        Returns the list of the results of function(*args) for every args of args_list, in the same order.
+        :param function: function defined at the top level of a module (so that it can be sent to the workers).
+        :param args_list: iterable of tuples.
+        :return: list.
+        """
+        if self.workers <= 1 or self.backend == "serial":
+            return [function(*args) for args in args_list]
+        if self.backend == "thread":
+            return list(self._get_pool().map(lambda args: function(*args), args_list))
+        return self._get_pool().starmap(function, args_list)
+
+    def close(self):
+        if self._pool is not None and self.backend == "thread":
+            self._pool.shutdown()
+            self._pool = None
+        elif self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._shared_tables.close()
+            self._shared_tables = None
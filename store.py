@@ -0,0 +1,152 @@
+"""A persistent store of simulation results, keyed by the canonical description of a scenario.
+
+A scenario is the private cards of the hero, the number of players, the known cards of the board and the dead cards.
+Two scenarios which only differ by a permutation of the suits (eg. "AsKs" and "AhKh") have the same equity, so they are
+stored under the same canonical key. The store keeps the state of the RunningSeries of the earnings (number of deals,
+sum and sum of squares) and not only the mean: new simulations of a scenario are merged with the previous ones, so the
+precision of a scenario improves at every run and the scenarios already simulated enough are free.
+With a seed, the deals of a top up are drawn from the random generators of their indexes in the scenario. The indexes
+are reserved in the store before the simulation (see ResultStore.reserve()), so concurrent top ups of a scenario (by
+several processes or by the equity server) never replay the same deals.
+Example usage :
+store = ResultStore("results.sqlite")
+series = store.estimate(simulation.card_ids_from_string("AsKs"), n_players=3, n_stories=100000)
+print(series.mean, series.n)
+"""
+import sqlite3
+import itertools
+
+import evaluator
+import simulation
+from tools import RunningSeries
+
+SUIT_PERMUTATIONS = list(itertools.permutations(range(evaluator.N_SUITS)))
+
+
+def canonical_scenario(hero_ids, n_players, board_ids=(), dead_ids=()):
+    """
+    Returns the canonical form of a scenario: among the 24 permutations of the suits, the one which gives the smallest
+    sorted card ids.
+    :param hero_ids: sequence of card ids.
+    :param n_players: integer.
+    :param board_ids: sequence of card ids.
+    :param dead_ids: sequence of card ids.
+    :return: (tuple, integer, tuple, tuple).
+    (hero_ids, n_players, board_ids, dead_ids) where the card ids are sorted.
+    """
+    n_ranks = evaluator.N_RANKS
+    candidates = []
+    for permutation in SUIT_PERMUTATIONS:
+        candidates.append(tuple(tuple(sorted(permutation[c // n_ranks] * n_ranks + c % n_ranks for c in cards))
+                                for cards in (hero_ids, board_ids, dead_ids)))
+    hero_ids, board_ids, dead_ids = min(candidates)
+    return hero_ids, n_players, board_ids, dead_ids
+
+
+def scenario_to_string(scenario):
+    """Returns a readable description of a canonical scenario (eg. "AsKs/3/Qs7h2s/"). Used as key in the store."""
+    hero_ids, n_players, board_ids, dead_ids = scenario
+    return "/".join([simulation.card_ids_to_string(hero_ids), str(n_players),
+                     simulation.card_ids_to_string(board_ids), simulation.card_ids_to_string(dead_ids)])
+
+
+class ResultStore:
+    """A SQLite database of the earnings of the hero in canonical scenarios."""
+    def __init__(self, path):
+        """
+        :param path: string. Path of the database file, created if it does not exist.
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS earnings (scenario TEXT PRIMARY KEY, "
+                                     "n INTEGER NOT NULL, values_sum REAL NOT NULL, squares_sum REAL NOT NULL)")
+            # scenario -> number of deal indexes reserved, see reserve()
+            self._connection.execute("CREATE TABLE IF NOT EXISTS reservations (scenario TEXT PRIMARY KEY, "
+                                     "n INTEGER NOT NULL)")
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, scenario):
+        """
+        Returns the RunningSeries of the earnings stored for a scenario (empty if the scenario is unknown).
+        :param scenario: tuple returned by canonical_scenario().
+        :return: RunningSeries.
+        """
+        row = self._connection.execute("SELECT n, values_sum, squares_sum FROM earnings WHERE scenario = ?",
+                                       (scenario_to_string(scenario),)).fetchone()
+        return RunningSeries.from_state(row) if row else RunningSeries()
+
+    def add(self, scenario, series):
+        """
+        Merges new results of a scenario into the store. The merge is done by the database in a single statement, so
+        several processes can add results of the same scenario concurrently.
+        :param scenario: tuple returned by canonical_scenario().
+        :param series: RunningSeries.
+        :return: RunningSeries. All the results stored for this scenario.
+        """
+        with self._connection:
+            self._connection.execute("INSERT INTO earnings VALUES (?, ?, ?, ?) ON CONFLICT(scenario) DO UPDATE SET "
+                                     "n = n + excluded.n, values_sum = values_sum + excluded.values_sum, "
+                                     "squares_sum = squares_sum + excluded.squares_sum",
+                                     [scenario_to_string(scenario)] + series.state)
+        return self.get(scenario)
+
+    def reserve(self, scenario, n_stories):
+        """
+        Reserves the indexes of n_stories new deals of a scenario and returns the first one. The reservation is done in
+        a single write transaction, so concurrent processes always get disjoint ranges of indexes. The indexes are used
+        in the keys of the random generators of the simulations (see estimate()).
+        :param scenario: tuple returned by canonical_scenario().
+        :param n_stories: integer.
+        :return: integer.
+        """
+        key = scenario_to_string(scenario)
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")  # locks the database until the commit
+            row = self._connection.execute("SELECT n FROM reservations WHERE scenario = ?", (key,)).fetchone()
+            first_index = row[0] if row else self.get(scenario).n  # the deals stored before any reservation
+            self._connection.execute("INSERT OR REPLACE INTO reservations VALUES (?, ?)",
+                                     (key, first_index + n_stories))
+        return first_index
+
+    def estimate(self, hero_ids, n_players, n_stories, board_ids=(), dead_ids=(), engine=None, seed=None):
+        """
+        Returns the earnings of the hero in a scenario with at least n_stories deals. Only the deals missing in the
+        store are simulated, and they are added to the store.
+        :param hero_ids: sequence of card ids.
+        :param n_players: integer.
+        :param n_stories: integer.
+        :param board_ids: sequence of card ids.
+        :param dead_ids: sequence of card ids.
+        :param engine: simulation.Engine or None.
+        If provided, the missing deals are simulated by the engine.
+        :param seed: integer or None.
+        :return: RunningSeries.
+        """
+        scenario = canonical_scenario(hero_ids, n_players, board_ids, dead_ids)
+        stored = self.get(scenario)
+        n_missing = n_stories - stored.n
+        if n_missing <= 0:
+            return stored
+        hero_ids, n_players, board_ids, dead_ids = scenario
+        # the first reserved index is part of the key of the units so that a seeded top up never replays the deals of
+        # a previous or concurrent run
+        first_index = self.reserve(scenario, n_missing)
+        units = [(hero_ids, n_players, n, seed, (scenario_to_string(scenario), first_index, i), board_ids, dead_ids)
+                 for i, n in enumerate(simulation.split_stories(n_missing))]
+        if engine is None:
+            states = [simulation.earnings_unit(*unit) for unit in units]
+        else:
+            states = engine.map(simulation.earnings_unit, units)
+        new_series = RunningSeries()
+        for state in states:
+            new_series.merge(RunningSeries.from_state(state))
+        return self.add(scenario, new_series)
@@ -0,0 +1,167 @@
+"""A runner for long simulation sweeps (eg. the 169 hand classes of Q5_step1) which can be interrupted and resumed.
+
+The partial results of every hand class (the state of its RunningSeries) and the state of the random generator are
+periodically written to a checkpoint file. The checkpoint is written atomically, so a crash at any time leaves
+either the previous or the new checkpoint on disk. When restarted with the same checkpoint path, the sweep resumes
+from the checkpoint and only simulates the missing deals.
+Example usage :
+sweep = Sweep(all_hand_classes(), n_players=8, n_stories=1600, checkpoint_path="q5_step1.json")
+results = sweep.run()  # dictionary hand class -> RunningSeries
+for hand_stats in sweep.ranking():
+    print(hand_stats)
+"""
+import os
+import json
+import time
+import random
+import tempfile
+
+import simulation
+from tools import RunningSeries, Clock
+
+
+def ranking(results):
+    """
+    Returns the list of (hand class, mean earning, 95% confidence range) sorted by descending mean, as in Q5.
+    :param results: dictionary hand class -> RunningSeries. The hand classes without deals are left out.
+    :return: list of (string, float, (float, float)).
+    """
+    hands_ranking = [(hand_class, series.mean, series.confidence_range) for hand_class, series in results.items()
+                     if series.n]
+    hands_ranking.sort(key=lambda x: x[1], reverse=True)
+    return hands_ranking
+
+
+def write_json_atomically(data, path):
+    """
+    Writes data as JSON to path. The file is first written to a temporary file of the same directory and then
+    renamed, so that the file at path is always complete.
+    :param data: object serializable in JSON.
+    :param path: string.
+    :return: None.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def rng_state_to_json(state):
+    """Turns the state of a random.Random (as returned by getstate()) into a JSON serializable list."""
+    version, internal_state, gauss_next = state
+    return [version, list(internal_state), gauss_next]
+
+
+def rng_state_from_json(data):
+    """Inverse of rng_state_to_json()."""
+    version, internal_state, gauss_next = data
+    return version, tuple(internal_state), gauss_next
+
+
+class Sweep:
+    """Simulates the earnings of a list of hand classes, with checkpoints."""
+    def __init__(self, hand_classes, n_players, n_stories, checkpoint_path=None, seed=None, chunk_size=1000,
+                 checkpoint_interval=10.):
+        """
+        :param hand_classes: iterable of strings (eg. ["AA", "AKs"]).
+        :param n_players: integer.
+        Number of players including the hero.
+        :param n_stories: integer.
+        Number of deals for each hand class.
+        :param checkpoint_path: string or None.
+        Path of the checkpoint file. If None, no checkpoint is written.
+        :param seed: integer or None.
+        Seed of the random generator.
+        :param chunk_size: integer.
+        Number of deals simulated between two checks of the checkpoint interval.
+        :param checkpoint_interval: float.
+        Minimal time in seconds between two checkpoints.
+        """
+        self.hand_classes = list(hand_classes)
+        self.n_players = n_players
+        self.n_stories = n_stories
+        self.checkpoint_path = checkpoint_path
+        self.chunk_size = chunk_size
+        self.checkpoint_interval = checkpoint_interval
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.results = {hand_class: RunningSeries() for hand_class in self.hand_classes}
+        self._last_checkpoint_time = time.monotonic()
+
+    @property
+    def config(self):
+        """The parameters of the sweep. A checkpoint can only be resumed by a sweep with the same config."""
+        return {"hand_classes": self.hand_classes, "n_players": self.n_players, "n_stories": self.n_stories,
+                "seed": self.seed}
+
+    def save_checkpoint(self):
+        """Writes the current state of the sweep to the checkpoint file."""
+        data = {"config": self.config,
+                "rng_state": rng_state_to_json(self.rng.getstate()),
+                "results": {hand_class: series.state for hand_class, series in self.results.items()}}
+        write_json_atomically(data, self.checkpoint_path)
+        self._last_checkpoint_time = time.monotonic()
+
+    def load_checkpoint(self):
+        """
+        Restores the state of the sweep from the checkpoint file. Returns False if there is no checkpoint file.
+        Raises a ValueError if the checkpoint was written by a sweep with a different config.
+        :return: boolean.
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return False
+        with open(self.checkpoint_path) as f:
+            data = json.load(f)
+        if data["config"] != self.config:
+            raise ValueError("The checkpoint {} was written by a different sweep: {}".format(self.checkpoint_path,
+                                                                                            data["config"]))
+        self.rng.setstate(rng_state_from_json(data["rng_state"]))
+        self.results = {hand_class: RunningSeries.from_state(state) for hand_class, state in data["results"].items()}
+        return True
+
+    def run(self, verbose=True):
+        """
+        Runs the sweep, resuming from the checkpoint file if there is one.
+        :param verbose: boolean.
+        If True, prints the progress after each hand class.
+        :return: dictionary.
+        The keys are the hand classes and the values are the RunningSeries of the earnings.
+        """
+        self.load_checkpoint()
+        for count, hand_class in enumerate(self.hand_classes, 1):
+            series = self.results[hand_class]
+            if series.n >= self.n_stories:
+                continue
+            hero_ids = simulation.hand_class_cards(hand_class)
+            while series.n < self.n_stories:
+                n_deals = min(self.chunk_size, self.n_stories - series.n)
+                simulation.simulate_earnings(hero_ids, self.n_players, n_deals, self.rng, series=series)
+                if self.checkpoint_path is not None and \
+                        time.monotonic() - self._last_checkpoint_time >= self.checkpoint_interval:
+                    self.save_checkpoint()
+            if verbose:
+                Clock.elapsed()
+                print("{}/{}".format(count, len(self.hand_classes)))
+        if self.checkpoint_path is not None:
+            self.save_checkpoint()
+        return self.results
+
+    def ranking(self):
+        """Returns the list of (hand class, mean earning, 95% confidence range) sorted by descending mean."""
+        return ranking(self.results)
+
+
+if __name__ == "__main__":
+    # Q5_step1 with checkpoints: run it again after an interruption to resume it.
+    sweep = Sweep(simulation.all_hand_classes(), n_players=8, n_stories=1600, checkpoint_path="Q5_step1.ckpt.json",
+                  seed=0)
+    sweep.run()
+    for hand_stats in sweep.ranking():
+        print(hand_stats)
@@ -1,6 +1,14 @@
+import os
+import sys
 import math
 import time
 import datetime
+import tracemalloc
+import contextlib
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 
 class Series:
@@ -61,6 +69,69 @@ class Series:
         self._confidence_range = (self._mean-half_range, self._mean+half_range)
 
 
+class RunningSeries:
+    """Same estimators as Series but computed from running sums: the values are not stored, so the memory used does
+    not depend on the number of values. Two running series can be merged, which allows to compute the estimators of a
+    sample split across several runs, processes or machines.
+    Example usage :
+    series = RunningSeries()
+    series.add(1)
+    series.extend([0, 1, 1])
+    series.merge(RunningSeries.from_state(other_series.state))
+    print(series.mean, series.confidence_range)
+    """
+    def __init__(self, values=()):
+        self.n = 0
+        self.values_sum = 0
+        self.squares_sum = 0
+        self.extend(values)
+
+    def add(self, value):
+        self.n += 1
+        self.values_sum += value
+        self.squares_sum += value**2
+
+    def extend(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Adds the values of another RunningSeries to this one. Returns self."""
+        self.n += other.n
+        self.values_sum += other.values_sum
+        self.squares_sum += other.squares_sum
+        return self
+
+    @property
+    def state(self):
+        """Returns the state of the series as a list [n, values_sum, squares_sum]. Serializable in JSON."""
+        return [self.n, self.values_sum, self.squares_sum]
+
+    @staticmethod
+    def from_state(state):
+        series = RunningSeries()
+        series.n, series.values_sum, series.squares_sum = state
+        return series
+
+    @property
+    def mean(self):
+        return self.values_sum / self.n
+
+    @property
+    def standard_deviation(self):
+        return math.sqrt(math.fabs(self.squares_sum / self.n - self.mean**2))
+
+    std = standard_deviation  # alias
+
+    @property
+    def confidence_range(self):
+        half_range = 1.96 * self.standard_deviation / math.sqrt(self.n)
+        return self.mean - half_range, self.mean + half_range
+
+    def __str__(self):
+        return "Series: mean={} ; std={} ; range={}".format(self.mean, self.standard_deviation, self.confidence_range)
+
+
 class Clock:
     """A simple class for quick measurements of elapsed times across multiple files and functions."""
     # last_time is shared across all instances of Clock
@@ -87,6 +158,198 @@ class Clock:
         return time_since_start, time_since_last_call
 
 
+def peak_rss():
+    """Returns the peak resident set size (RSS) of this process in bytes, or None if it is unknown. It is the peak since
+    the start of the process, or on Linux since the last call to reset_peak_rss()."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # bytes on macOS, kilobytes on Linux
+
+
+def reset_peak_rss():
+    """Resets the peak RSS of this process to its current RSS. Only possible on Linux. Returns True if it was reset."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def current_rss():
+    """Returns the current resident set size (RSS) of this process in bytes. Falls back to peak_rss() where the current
+    value is not available (outside Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return peak_rss()
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """Raised by MemoryMonitor.check() when the memory used by the process exceeds the budget. Its message is the
+    report of the monitor."""
+
+
+class MemoryMonitor:
+    """Opt-in memory instrumentation of a run split into named phases (eg. "deal", "evaluate", "aggregate").
+    For each phase, the monitor records the peak RSS of the phase (on Linux, where the peak of the process can be reset;
+    elsewhere only the peak of the process so far is known) and, if trace is True, the memory allocated by
+    Python during the phase (net and peak, with tracemalloc) and its largest allocation sites. A phase can run several
+    times (eg. once per hand class): its statistics are accumulated.
+    With a budget, over_budget() tells when the process gets close to it, so that a run can switch from storing its
+    samples to streaming aggregation (eg. a RunningSeries or a dictionary of counts), and check() raises a
+    MemoryBudgetExceeded with the report before the host starts swapping.
+    Example usage :
+    memory = MemoryMonitor(budget=2 * 1024 ** 3, trace=True)
+    with memory.phase("evaluate", n_samples=n_stories):
+        for i in range(n_stories):
+            ...
+            if memory.over_budget():
+                ...  # switch to streaming aggregation
+            memory.check()
+    print(memory.report())
+    """
+    def __init__(self, budget=None, trace=False, soft_ratio=0.8, n_top_sites=3):
+        """
+        :param budget: integer or None. Memory budget of the process in bytes (RSS).
+        :param trace: boolean. If True, tracemalloc traces the allocations during the phases. It slows the run down.
+        :param soft_ratio: float. over_budget() is True above soft_ratio * budget.
+        :param n_top_sites: integer. Number of allocation sites reported per phase when trace is True.
+        """
+        self.budget = budget
+        self.trace = trace
+        self.soft_ratio = soft_ratio
+        self.n_top_sites = n_top_sites
+        self.phases = {}  # name -> dictionary of statistics, in the order of their first run
+        self._current_phase = None
+        self._process_peak_rss = None  # peak of the process, kept across the resets of the phases
+
+    def _update_process_peak_rss(self, rss):
+        if rss is not None:
+            self._process_peak_rss = max(rss, self._process_peak_rss or 0)
+
+    @contextlib.contextmanager
+    def phase(self, name, n_samples=0):
+        """
+        Context manager measuring the memory of a phase. The phases must not be nested.
+        :param name: string.
+        :param n_samples: integer. Number of samples (eg. deals) handled by the phase, for bytes_per_sample().
+        """
+        if self._current_phase is not None:
+            raise RuntimeError("Phase '{}' started inside phase '{}'.".format(name, self._current_phase))
+        stats = self.phases.setdefault(name, {"runs": 0, "n_samples": 0, "rss_growth": 0, "peak_rss": None,
+                                              "peak_rss_of_phase": True, "allocated": 0, "traced_peak": 0,
+                                              "top_sites": []})
+        started_tracing = self.trace and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        self._update_process_peak_rss(peak_rss())
+        peak_reset = reset_peak_rss()
+        rss_before = current_rss()
+        self._current_phase = name
+        try:
+            yield stats
+        finally:
+            self._current_phase = None
+            stats["runs"] += 1
+            stats["n_samples"] += n_samples
+            rss_after = current_rss()
+            if rss_before is not None and rss_after is not None:
+                stats["rss_growth"] += rss_after - rss_before
+            peak = peak_rss()  # read before the snapshot of tracemalloc, which allocates memory
+            self._update_process_peak_rss(peak)
+            stats["peak_rss_of_phase"] = stats["peak_rss_of_phase"] and peak_reset
+            if peak is not None:
+                stats["peak_rss"] = peak if stats["peak_rss"] is None else max(stats["peak_rss"], peak)
+            if self.trace:
+                traced_after, traced_peak = tracemalloc.get_traced_memory()
+                stats["allocated"] += traced_after - traced_before
+                stats["traced_peak"] = max(stats["traced_peak"], traced_peak - traced_before)
+                snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__),
+                                                                      tracemalloc.Filter(False, tracemalloc.__file__)])
+                statistics = snapshot.statistics("lineno")
+                stats["top_sites"] = ["{} ({})".format(s.traceback, bytes2str(s.size))
+                                      for s in statistics[:self.n_top_sites]]
+            if started_tracing:
+                tracemalloc.stop()
+
+    def bytes_per_sample(self, name):
+        """Returns the memory kept per sample by a phase: the net allocations traced by tracemalloc if trace is True,
+        otherwise the growth of the RSS. None if the phase has no sample."""
+        stats = self.phases[name]
+        if not stats["n_samples"]:
+            return None
+        return (stats["allocated"] if self.trace else stats["rss_growth"]) / stats["n_samples"]
+
+    def usage(self):
+        """Returns the memory used by the process in bytes (current RSS)."""
+        return current_rss()
+
+    def over_budget(self):
+        """Returns True if the memory used is above soft_ratio * budget. Always False without budget."""
+        if self.budget is None:
+            return False
+        usage = self.usage()
+        return usage is not None and usage > self.soft_ratio * self.budget
+
+    def check(self):
+        """Raises a MemoryBudgetExceeded with the report if the memory used is above the budget."""
+        if self.budget is None:
+            return
+        usage = self.usage()
+        if usage is not None and usage > self.budget:
+            raise MemoryBudgetExceeded("Memory budget of {} exceeded ({} used).\n{}".format(
+                bytes2str(self.budget), bytes2str(usage), self.report()))
+
+    def report(self):
+        """Returns the statistics of every phase as a multiline string."""
+        rss = current_rss()
+        self._update_process_peak_rss(peak_rss())
+        self._update_process_peak_rss(rss)  # both are not measured at the same time
+        max_rss = self._process_peak_rss
+        lines = ["Memory: current RSS {} ; peak RSS {} ; budget {}".format(
+            bytes2str(rss), bytes2str(max_rss), "none" if self.budget is None else bytes2str(self.budget))]
+        for name, stats in self.phases.items():
+            line = "- {}: {} run(s) ; {} samples ; RSS growth {} ; {} {}".format(
+                name, stats["runs"], stats["n_samples"], bytes2str(stats["rss_growth"]),
+                "peak RSS" if stats["peak_rss_of_phase"] else "process peak RSS so far", bytes2str(stats["peak_rss"]))
+            if self.trace:
+                line += " ; allocated {} (peak {})".format(bytes2str(stats["allocated"]),
+                                                           bytes2str(stats["traced_peak"]))
+            if self.bytes_per_sample(name) is not None:
+                line += " ; {:.1f} bytes per sample".format(self.bytes_per_sample(name))
+            lines.append(line)
+            lines.extend("    {}".format(site) for site in stats["top_sites"])
+        return "\n".join(lines)
+
+
+def bytes2str(n_bytes):
+    """
+    Turns a number of bytes to a string with a binary unit, eg. '1.5 MiB'.
+    :param n_bytes: integer or None.
+    :return: string.
+    """
+    if n_bytes is None:
+        return "unknown"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n_bytes) < 1024:
+            return "{:.1f} {}".format(n_bytes, unit)
+        n_bytes /= 1024
+    return "{:.1f} TiB".format(n_bytes)
+
+
 def sec2time(time_in_sec):
     """
     Turns a time expressed in seconds to a string formatted like 'days hours:minutes:seconds.microseconds'
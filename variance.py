@@ -0,0 +1,235 @@
+"""Variance reduction for the estimation of the earnings of a hero hand (the quantity of Q5_step1.py and Q5_step2.py).
+
+With plain i.i.d. deals the confidence range shrinks as 1/sqrt(n). The following sampling strategies give the same
+expected value with a smaller variance per deal:
+- "stratified": the deals are stratified by flop (by default by the category of the hand made by the hero on the flop,
+  or by the suit pattern of the flop). The probability of each stratum is computed exactly by enumerating the flops,
+  each stratum is sampled in proportion to its probability and the means of the strata are weighted by their
+  probabilities.
+- "antithetic": each deal is paired with its mirror deal where every card is replaced by the card of opposite rank
+  among the remaining cards (the strongest cards become the weakest). Both deals are uniform but negatively
+  correlated.
+- "control_variate": the share of the pot of the hero against the first opponent alone is a control variate whose
+  expected value is the heads-up all-in equity of the hero hand against a random hand (the reference). The error of
+  the reference is an error of the estimate: a reference which is itself a Monte Carlo estimate (eg.
+  matchups.MatchupMatrix.equity_against_random()) must come with its variance (eg.
+  matchups.MatchupMatrix.equity_against_random_variance()), which is added to the variance of the estimate. Only an
+  exact reference may have a variance of 0.
+Every strategy reports its variance reduction factor: the number of plain deals needed to reach the same precision as
+one deal of the strategy.
+
+The results of a work unit are mergeable states, so the strategies run on the simulation engine like the plain
+simulations.
+Example usage :
+estimate = estimate_earnings(simulation.hand_class_cards("AKs"), 8, 100000, "stratified", seed=0)
+print(estimate.mean, estimate.confidence_range, estimate.variance_reduction_factor)
+"""
+import math
+import itertools
+
+import evaluator
+import pipeline
+import simulation
+from tools import RunningSeries
+
+STRATEGIES = ["plain", "stratified", "antithetic", "control_variate"]
+
+
+class Estimate:
+    """An estimate of a mean with its standard error and the variance reduction factor of the strategy used."""
+    def __init__(self, mean, standard_error, n, variance_reduction_factor=1.):
+        self.mean = mean
+        self.standard_error = standard_error
+        self.n = n  # number of deals
+        self.variance_reduction_factor = variance_reduction_factor
+
+    @property
+    def confidence_range(self):
+        half_range = 1.96 * self.standard_error
+        return self.mean - half_range, self.mean + half_range
+
+    def __str__(self):
+        return "Estimate: mean={} ; range={} ; n={} ; variance reduction factor={}".format(
+            self.mean, self.confidence_range, self.n, self.variance_reduction_factor)
+
+
+def _play(cards, evaluate):
+    """
+    Plays a deal. Returns (earning of the hero, share of the pot of the hero against the first opponent alone).
+    :param cards: list of card ids in the order of pipeline.deal(): the 5 cards of the board, the 2 cards of the hero
+    then the 2 cards of each opponent.
+    :param evaluate: function.
+    :return: (float, float).
+    """
+    strengths = pipeline.evaluate_deal(cards, evaluate)
+    hero_strength, opponent_strength = strengths[0], strengths[1]
+    heads_up_share = 1. if hero_strength > opponent_strength else 0.5 if hero_strength == opponent_strength else 0.
+    return pipeline.deal_earnings(strengths)[0], heads_up_share
+
+
+def flop_strata(hero_ids, stratify_by="flop_category"):
+    """
+    Groups the possible flops into strata.
+    :param hero_ids: sequence of 2 card ids.
+    :param stratify_by: string. "flop_category" (category of the hand made by the hero on the flop) or
+    "suit_pattern" (number of cards of each suit of the flop, eg. monotone, two-tone, rainbow).
+    :return: dictionary. The keys are the strata and the values are the lists of their flops.
+    """
+    evaluate = evaluator.get_tables().evaluate
+    hero_ids = list(hero_ids)
+    strata = {}
+    for flop in itertools.combinations(simulation.remaining_card_ids(hero_ids), 3):
+        if stratify_by == "flop_category":
+            stratum = evaluator.category(evaluate(hero_ids + list(flop)))
+        elif stratify_by == "suit_pattern":
+            stratum = tuple(sorted((sum(1 for c in flop if c // evaluator.N_RANKS == suit)
+                                    for suit in range(evaluator.N_SUITS)), reverse=True))
+        else:
+            raise ValueError("Unknown stratification '{}'.".format(stratify_by))
+        strata.setdefault(stratum, []).append(list(flop))
+    return strata
+
+
+def mirror_permutation(remaining):
+    """
+    Returns the antithetic permutation of the remaining cards: the remaining cards sorted by rank are mapped to the
+    same list in reverse order.
+    :param remaining: iterable of card ids.
+    :return: dictionary card id -> card id.
+    """
+    remaining = sorted(remaining, key=lambda c: (c % evaluator.N_RANKS, c))
+    return dict(zip(remaining, reversed(remaining)))
+
+
+def variance_unit(strategy, hero_ids, n_players, n_stories, seed, key, stratify_by="flop_category"):
+    """
+    Work unit of estimate_earnings(). Returns a mergeable state (serializable in JSON) of the strategy:
+    - "plain": state of the RunningSeries of the earnings.
+    - "stratified": list of [stratum, state of the RunningSeries of the earnings of the stratum].
+    - "antithetic": [state of the RunningSeries of the pair means, state of the RunningSeries of the earnings].
+    - "control_variate": [n, sum of y, sum of x, sum of y^2, sum of x^2, sum of x*y] where y is the earning and x the
+      heads-up share of the pot.
+    """
+    rng = simulation.unit_rng(seed, *key)
+    evaluate = evaluator.get_tables().evaluate
+    hero_ids = list(hero_ids)
+    remaining = simulation.remaining_card_ids(hero_ids)
+    n_opponents_cards = 2 * (n_players - 1)
+    if strategy == "plain":
+        return simulation.simulate_earnings(hero_ids, n_players, n_stories, rng).state
+    if strategy == "stratified":
+        strata = flop_strata(hero_ids, stratify_by)
+        n_flops = sum(len(flops) for flops in strata.values())
+        states = []
+        for stratum, flops in sorted(strata.items()):
+            series = RunningSeries()
+            for i in range(max(2, round(n_stories * len(flops) / n_flops))):  # proportional allocation
+                flop = rng.choice(flops)
+                rest = rng.sample([c for c in remaining if c not in flop], 2 + n_opponents_cards)
+                series.add(_play(flop + rest[:2] + hero_ids + rest[2:], evaluate)[0])
+            states.append([stratum, series.state])
+        return states
+    if strategy == "antithetic":
+        mirror = mirror_permutation(remaining)
+        pairs, singles = RunningSeries(), RunningSeries()
+        for i in range(n_stories // 2):
+            drawn = rng.sample(remaining, 5 + n_opponents_cards)
+            y1 = _play(drawn[:5] + hero_ids + drawn[5:], evaluate)[0]
+            mirrored = [mirror[c] for c in drawn]
+            y2 = _play(mirrored[:5] + hero_ids + mirrored[5:], evaluate)[0]
+            pairs.add((y1 + y2) / 2)
+            singles.extend((y1, y2))
+        return [pairs.state, singles.state]
+    if strategy == "control_variate":
+        sums = [0] * 6
+        for i in range(n_stories):
+            drawn = rng.sample(remaining, 5 + n_opponents_cards)
+            y, x = _play(drawn[:5] + hero_ids + drawn[5:], evaluate)
+            for j, value in enumerate((1, y, x, y * y, x * x, x * y)):
+                sums[j] += value
+        return sums
+    raise ValueError("Unknown strategy '{}'. Available strategies: {}".format(strategy, STRATEGIES))
+
+
+def combine(strategy, states, hero_ids=None, reference_equity=None, stratify_by="flop_category",
+            reference_variance=0.):
+    """
+    Merges the states of the work units of a strategy and returns the estimate of the earnings.
+    :param strategy: string. One of STRATEGIES.
+    :param states: list of states returned by variance_unit().
+    :param hero_ids: sequence of 2 card ids. Needed by the "stratified" strategy (for the weights of the strata).
+    :param reference_equity: float. Needed by the "control_variate" strategy: the heads-up equity of the hero against
+    a random hand.
+    :param stratify_by: string. See flop_strata().
+    :param reference_variance: float. Variance of the error of reference_equity (0 for an exact reference).
+    :return: Estimate.
+    """
+    if strategy == "plain":
+        series = RunningSeries()
+        for state in states:
+            series.merge(RunningSeries.from_state(state))
+        return Estimate(series.mean, series.standard_deviation / math.sqrt(series.n), series.n)
+    if strategy == "stratified":
+        strata = flop_strata(hero_ids, stratify_by)
+        n_flops = sum(len(flops) for flops in strata.values())
+        merged = {}
+        for state in states:
+            for stratum, series_state in state:
+                stratum = tuple(stratum) if isinstance(stratum, list) else stratum
+                merged.setdefault(stratum, RunningSeries()).merge(RunningSeries.from_state(series_state))
+        weights = {stratum: len(flops) / n_flops for stratum, flops in strata.items()}
+        mean = sum(weights[s] * series.mean for s, series in merged.items())
+        variance_of_mean = sum(weights[s] ** 2 * series.standard_deviation ** 2 / series.n
+                               for s, series in merged.items())
+        within_variance = sum(weights[s] * series.standard_deviation ** 2 for s, series in merged.items())
+        plain_variance = within_variance + sum(weights[s] * (series.mean - mean) ** 2 for s, series in merged.items())
+        n = sum(series.n for series in merged.values())
+        return Estimate(mean, math.sqrt(variance_of_mean), n, plain_variance / within_variance)
+    if strategy == "antithetic":
+        pairs, singles = RunningSeries(), RunningSeries()
+        for pairs_state, singles_state in states:
+            pairs.merge(RunningSeries.from_state(pairs_state))
+            singles.merge(RunningSeries.from_state(singles_state))
+        pair_variance = pairs.standard_deviation ** 2
+        return Estimate(pairs.mean, math.sqrt(pair_variance / pairs.n), singles.n,
+                        singles.standard_deviation ** 2 / (2 * pair_variance))
+    if strategy == "control_variate":
+        n, sum_y, sum_x, sum_yy, sum_xx, sum_xy = [sum(column) for column in zip(*states)]
+        mean_y, mean_x = sum_y / n, sum_x / n
+        variance_y, variance_x = sum_yy / n - mean_y ** 2, sum_xx / n - mean_x ** 2
+        covariance = sum_xy / n - mean_x * mean_y
+        coefficient = covariance / variance_x
+        correlation_2 = min(covariance ** 2 / (variance_x * variance_y), 1 - 1e-12)
+        mean = mean_y - coefficient * (mean_x - reference_equity)
+        # the error of the reference is independent of the deals and is scaled by the coefficient in the mean
+        variance_of_mean = variance_y * (1 - correlation_2) / n + coefficient ** 2 * reference_variance
+        return Estimate(mean, math.sqrt(variance_of_mean), n, variance_y / n / variance_of_mean)
+    raise ValueError("Unknown strategy '{}'. Available strategies: {}".format(strategy, STRATEGIES))
+
+
+def estimate_earnings(hero_ids, n_players, n_stories, strategy="plain", engine=None, seed=None,
+                      reference_equity=None, stratify_by="flop_category", unit_size=simulation.UNIT_SIZE,
+                      reference_variance=0.):
+    """
+    Estimates the earnings of the hero with a sampling strategy.
+    :param hero_ids: sequence of 2 card ids.
+    :param n_players: integer.
+    :param n_stories: integer. Approximate number of deals.
+    :param strategy: string. One of STRATEGIES.
+    :param engine: simulation.Engine or None. If provided, the work units are run by the engine.
+    :param seed: integer or None.
+    :param reference_equity: float or None. Heads-up equity of the hero hand against a random hand. Required by the
+    "control_variate" strategy.
+    :param stratify_by: string. See flop_strata().
+    :param unit_size: integer. Number of deals per work unit.
+    :param reference_variance: float. Variance of the error of reference_equity, eg.
+    matchups.MatchupMatrix.equity_against_random_variance(). 0 only for an exact reference.
+    :return: Estimate.
+    """
+    if strategy == "control_variate" and reference_equity is None:
+        raise ValueError("The control_variate strategy needs the reference equity of the hero hand.")
+    hero_ids = list(hero_ids)
+    units = [(strategy, hero_ids, n_players, n, seed, (strategy, i), stratify_by)
+             for i, n in enumerate(simulation.split_stories(n_stories, unit_size))]
+    states = engine.map(variance_unit, units) if engine is not None else [variance_unit(*unit) for unit in units]
+    return combine(strategy, states, hero_ids, reference_equity, stratify_by, reference_variance)